@@ -1,8 +1,17 @@
+import hashlib
+import io
 import os
 import logging
-from flask import Flask, request, jsonify
+import queue
+import shutil
+import threading
+import time
+import orjson
+from flask import Flask, request, Response
+from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-from rag_processor import RAGProcessor # We will create this class in rag_processor.py
+from rag_processor import RAGProcessor, ERROR_ANSWER # We will create this class in rag_processor.py
+from query_cache import QueryCache, SemanticQueryCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,7 +21,8 @@ load_dotenv()
 
 # --- Configuration ---
 UPLOAD_FOLDER = 'data/uploads' # Store uploaded files here
-ALLOWED_EXTENSIONS = {'txt', 'pdf'}
+ALLOWED_EXTENSIONS = frozenset({'txt', 'pdf'})
+ALLOWED_SUFFIXES = tuple(f'.{ext}' for ext in sorted(ALLOWED_EXTENSIONS))
 # Ensure data directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('data/vector_store', exist_ok=True) # For FAISS index etc.
@@ -21,32 +31,299 @@ os.makedirs('data/vector_store', exist_ok=True) # For FAISS index etc.
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# --- Initialize RAG Processor ---
-# This object will hold the logic for processing, embedding, storing, and querying
-try:
-    rag_processor = RAGProcessor(
-        embedding_model_name='all-MiniLM-L6-v2', # A popular sentence-transformer model
-        vector_store_path='data/vector_store'
-    )
-    logging.info("RAG Processor initialized successfully.")
-except Exception as e:
-    logging.error(f"Failed to initialize RAG Processor: {e}", exc_info=True)
-    # Depending on the desired behavior, you might want to exit or run in a limited mode.
-    # For now, we'll let it potentially fail later if used.
-    rag_processor = None
-
-# --- Helper Function ---
+# The heartbeat body never changes, so serialize it once at import time
+# and skip any per-request allocation on this high-QPS endpoint.
+HEARTBEAT_BODY = orjson.dumps({"status": "ok"})
+
+class HeartbeatMiddleware:
+    """
+    Serves GET /heartbeat straight from the WSGI layer with a precomputed
+    body, before Flask routing, rule matching, or logging ever run.
+    Monitors (load balancers, liveness probes) hit this path constantly,
+    so skipping the full dispatch stack keeps probe cost near zero.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self._headers = [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(HEARTBEAT_BODY))),
+        ]
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == '/heartbeat' and environ.get('REQUEST_METHOD') == 'GET':
+            start_response('200 OK', self._headers)
+            return [HEARTBEAT_BODY]
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = HeartbeatMiddleware(app.wsgi_app)
+
+class _HeartbeatLogFilter(logging.Filter):
+    """Keeps high-frequency heartbeat probes out of the access log."""
+    def filter(self, record):
+        return '/heartbeat' not in record.getMessage()
+
+logging.getLogger('werkzeug').addFilter(_HeartbeatLogFilter())
+
+# --- RAG Processor (lazy) ---
+# Loading the embedding model and FAISS index takes seconds and ~hundreds of
+# MB, which used to block startup even for instances that only ever serve
+# /heartbeat. The processor is now created on first real use behind a
+# double-checked lock; a background warm-up thread below hides the load time
+# from the first query without blocking startup.
+_rag_processor = None
+_rag_lock = threading.Lock()
+semantic_cache = None # Created together with the processor (needs its dim)
+
+def _tune_torch_for_inference(processor):
+    """
+    Sets torch CPU thread counts and runs a dummy encode so the one-time
+    kernel/JIT warm-up cost is paid at startup instead of on the first
+    user query. Thread counts are CPU-only tuning; on CUDA the defaults
+    are left alone. Override with the TORCH_NUM_THREADS env var.
+    """
+    try:
+        import torch
+        if not torch.cuda.is_available():
+            num_threads = int(os.getenv('TORCH_NUM_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+            torch.set_num_threads(num_threads)
+            try:
+                torch.set_num_interop_threads(2)
+            except RuntimeError:
+                pass # Interop count can only be set before parallel work starts.
+            logging.info(f"torch intra-op threads set to {num_threads}.")
+        processor.embedding_model.encode(["warmup"])
+        logging.info("Embedding model warm-up encode complete.")
+    except Exception as e:
+        logging.warning(f"Torch tuning/warm-up skipped: {e}")
+
+def get_rag():
+    """
+    Returns the shared RAGProcessor, creating it (and the semantic cache)
+    on first use. Raises if initialization fails.
+    """
+    global _rag_processor, semantic_cache
+    if _rag_processor is None:
+        with _rag_lock:
+            if _rag_processor is None:
+                logging.info("Initializing RAG Processor...")
+                processor = RAGProcessor(
+                    embedding_model_name='all-MiniLM-L6-v2', # A popular sentence-transformer model
+                    vector_store_path='data/vector_store'
+                )
+                _tune_torch_for_inference(processor)
+                semantic_cache = SemanticQueryCache(processor.embedding_dim)
+                _rag_processor = processor
+                logging.info("RAG Processor initialized successfully.")
+    return _rag_processor
+
+def _warm_up_rag():
+    """Loads the processor in the background so the first query doesn't pay for it."""
+    try:
+        get_rag()
+    except Exception as e:
+        logging.error(f"Background RAG warm-up failed: {e}", exc_info=True)
+
+_warmup_started = False
+_warmup_start_lock = threading.Lock()
+
+def start_rag_warmup():
+    """
+    Kicks off the background warm-up thread (idempotent).
+
+    Deliberately NOT called at import time: under `gunicorn --preload` the
+    master imports this module before forking, and a warm-up thread holding
+    _rag_lock across the fork would leave every worker with a locked lock
+    and no thread to release it - get_rag() would then block forever.
+    Instead each worker starts its own warm-up after the fork (see the
+    post_fork hook in gunicorn.conf.py); the dev server calls this from
+    __main__ below.
+    """
+    global _warmup_started
+    if _warmup_started:
+        return
+    with _warmup_start_lock:
+        if not _warmup_started:
+            threading.Thread(target=_warm_up_rag, daemon=True, name="rag-warmup").start()
+            _warmup_started = True
+
+# --- Query Answer Cache ---
+# Answers are cached keyed on (corpus version, normalized query text) so a
+# repeated question skips embedding, FAISS search, and the OpenAI call
+# entirely. The corpus version bumps on every successful upload, which
+# implicitly invalidates all cached answers for the old document set.
+query_cache = QueryCache(max_size=2000, ttl_seconds=300)
+_corpus_version = 0
+
+# A second, semantic layer catches paraphrased questions the exact-match
+# cache misses: the batch worker reuses the query embedding it already
+# computed to look up answers of near-identical (cosine >= 0.9) past
+# queries. It is created lazily in get_rag() above, since it needs the
+# embedding dimension.
+
+def _note_corpus_changed():
+    """Bumps the corpus version and drops cached answers after an upload."""
+    global _corpus_version
+    _corpus_version += 1
+    query_cache.invalidate()
+    if semantic_cache is not None:
+        semantic_cache.invalidate()
+
+def _query_cache_key(query_text):
+    """Builds the cache key for a query against the current corpus."""
+    normalized = f"{_corpus_version}:{query_text.strip().lower()}"
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+# --- Query Micro-Batching ---
+# Concurrent /query requests each trigger a separate embedding forward pass,
+# which wastes the batching speedup the sentence-transformer provides on CPU.
+# Instead, requests drop their query onto a queue and a single worker thread
+# coalesces everything that arrives within a short window into one
+# rag_processor.answer_queries_batch call.
+QUERY_BATCH_MAX_SIZE = 32
+QUERY_BATCH_MAX_WAIT_MS = 15
+QUERY_TIMEOUT_SECONDS = 120
+
+class PendingQuery:
+    """A query waiting for the batch worker, plus its result slot."""
+    def __init__(self, query):
+        self.query = query
+        self.event = threading.Event()
+        self.answer = None
+        self.error = None
+
+_query_queue = queue.Queue()
+_batch_worker_started = False
+_batch_worker_lock = threading.Lock()
+
+def _query_batch_worker():
+    """Drains the query queue in small batches and answers them together."""
+    while True:
+        # Block until at least one query arrives, then collect whatever else
+        # shows up within the wait window (up to the batch cap).
+        batch = [_query_queue.get()]
+        deadline = time.monotonic() + QUERY_BATCH_MAX_WAIT_MS / 1000.0
+        while len(batch) < QUERY_BATCH_MAX_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_query_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Sort by query length so the encoder pads batches minimally
+        # (mimics sentence-transformers' smart batching).
+        order = sorted(range(len(batch)), key=lambda i: len(batch[i].query))
+        queries = [batch[i].query for i in order]
+        logging.info(f"Processing query batch of size {len(batch)}.")
+        try:
+            rag = get_rag()
+            # With multiple gunicorn workers, an upload lands in one
+            # worker's memory and on disk; the others find out here and
+            # reload before answering (stale cached answers go with it).
+            if rag.refresh_if_stale():
+                _note_corpus_changed()
+            embeddings = rag.embed_queries(queries)
+
+            # Try the semantic cache first; each embedding is computed once
+            # and reused for both the cache lookup and retrieval on a miss.
+            miss_positions = []
+            if embeddings is not None and semantic_cache is not None:
+                for batch_position, embedding in zip(order, embeddings):
+                    cached_answer = semantic_cache.get(embedding)
+                    if cached_answer is not None:
+                        logging.info(f"Semantic cache hit for query: '{batch[batch_position].query}'")
+                        batch[batch_position].answer = cached_answer
+                    else:
+                        miss_positions.append(batch_position)
+            else:
+                miss_positions = list(order)
+
+            if miss_positions:
+                miss_queries = [batch[p].query for p in miss_positions]
+                miss_embeddings = None
+                if embeddings is not None:
+                    position_in_order = {p: j for j, p in enumerate(order)}
+                    miss_embeddings = embeddings[[position_in_order[p] for p in miss_positions]]
+                answers = rag.answer_queries_batch(miss_queries, query_embeddings=miss_embeddings)
+                for batch_position, answer in zip(miss_positions, answers):
+                    batch[batch_position].answer = answer
+                    # Never cache the failure sentinel: the semantic cache
+                    # has no TTL, so one transient OpenAI outage would
+                    # poison every similar query until the next upload.
+                    if (answer != ERROR_ANSWER and miss_embeddings is not None
+                            and semantic_cache is not None):
+                        semantic_cache.put(embeddings[position_in_order[batch_position]], answer)
+        except Exception as e:
+            logging.error(f"Query batch failed: {e}", exc_info=True)
+            for pending in batch:
+                pending.error = e
+        for pending in batch:
+            pending.event.set()
+
+def _ensure_batch_worker():
+    """Starts the batch worker thread once (lazily, so forked gunicorn workers each get their own)."""
+    global _batch_worker_started
+    if _batch_worker_started:
+        return
+    with _batch_worker_lock:
+        if not _batch_worker_started:
+            threading.Thread(target=_query_batch_worker, daemon=True, name="query-batch-worker").start()
+            _batch_worker_started = True
+            logging.info("Query batch worker started.")
+
+# --- Helper Functions ---
+def ojsonify(obj, status=200):
+    """
+    Serializes a response body with orjson instead of Flask's jsonify.
+    orjson is a C extension and is several times faster than the stdlib
+    json module on the small payloads these endpoints return.
+    """
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
 def allowed_file(filename):
     """Checks if the uploaded file has an allowed extension."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    # endswith with a tuple is a single C call - no intermediate split list.
+    return filename.lower().endswith(ALLOWED_SUFFIXES)
+
+def persist_upload(stream, path):
+    """
+    Writes an uploaded stream to disk.
+
+    When the stream wraps a real file descriptor (large uploads spill to a
+    temp file), os.sendfile copies it to the target entirely in kernel
+    space - no user-space read/write loop. Small in-memory uploads fall
+    back to shutil.copyfileobj with a 1 MiB buffer.
+    """
+    try:
+        src_fd = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        src_fd = None
+
+    if src_fd is not None and hasattr(os, 'sendfile'):
+        dst_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            offset = 0
+            while True:
+                sent = os.sendfile(dst_fd, src_fd, offset, 1 << 20)
+                if sent == 0:
+                    break
+                offset += sent
+        finally:
+            os.close(dst_fd)
+    else:
+        stream.seek(0)
+        with open(path, 'wb') as out:
+            shutil.copyfileobj(stream, out, length=1 << 20)
 
 @app.route('/heartbeat', methods=['GET'])
 def heartbeat():
     """
     Simple health check endpoint to verify the server is running.
+    Normally unreachable: HeartbeatMiddleware answers the probe at the
+    WSGI layer before Flask dispatch. Kept as documentation/fallback.
     """
-    return jsonify({"status": "ok"}), 200
+    return Response(HEARTBEAT_BODY, status=200, mimetype='application/json')
 
 # --- API Endpoints ---
 @app.route('/upload', methods=['POST'])
@@ -55,37 +332,83 @@ def upload_document():
     API endpoint to upload a document (txt or pdf).
     Processes the document and adds it to the vector store.
     """
-    if rag_processor is None:
-         return jsonify({"error": "RAG Processor not initialized"}), 500
+    try:
+        rag = get_rag()
+    except Exception as e:
+        logging.error(f"Failed to initialize RAG Processor: {e}", exc_info=True)
+        return ojsonify({"error": "RAG Processor not initialized"}, 500)
+
+    # Sync with other workers' writes BEFORE ingesting: a stale worker
+    # would otherwise ingest into (and then save/compact from) an
+    # in-memory store that is missing their documents, and its shard
+    # save would mark those unreplayed shards as seen - or delete them
+    # outright at compaction - losing the documents for good.
+    if rag.refresh_if_stale():
+        _note_corpus_changed()
 
-    if request.files['file'] is None:
-        return jsonify({"error": "No file part in the request"}), 400
+    # Streamed raw-body upload: the GUI sends the file as a chunked
+    # application/octet-stream body with the name in X-Filename, so neither
+    # side ever holds a whole multipart body in memory.
+    raw_filename = request.headers.get('X-Filename')
+    if raw_filename is not None:
+        if not allowed_file(raw_filename):
+            return ojsonify({"error": "File type not allowed. Please upload .txt or .pdf"}, 400)
+        try:
+            safe_name = secure_filename(raw_filename)
+            filename = os.path.join(app.config['UPLOAD_FOLDER'], safe_name)
+            with open(filename, 'wb') as out:
+                shutil.copyfileobj(request.stream, out, length=1 << 20)
+            logging.info(f"File '{filename}' streamed to disk successfully.")
+
+            # Process the saved copy by path: large PDFs then go through
+            # the process-pool page extraction, which streams can't use.
+            rag.add_document(filename)
+            logging.info(f"Document '{filename}' processed and added to vector store.")
+            _note_corpus_changed()
+            return ojsonify({"message": f"Document '{raw_filename}' uploaded and processed successfully."}, 200)
+        except Exception as e:
+            logging.error(f"Error processing streamed file {raw_filename}: {e}", exc_info=True)
+            return ojsonify({"error": f"Failed to process file: {str(e)}"}, 500)
+
+    # Multipart form upload (curl -F, browsers, older clients).
+    # .get avoids raising (and catching) a KeyError when the part is absent,
+    # which previously surfaced as a 500 instead of the intended 400.
+    file = request.files.get('file')
+    if file is None:
+        return ojsonify({"error": "No file part in the request"}, 400)
 
-    file = request.files['file']
     if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        return ojsonify({"error": "No selected file"}, 400)
 
     if file and allowed_file(file.filename):
         try:
-            # Save the uploaded file temporarily
-            filename = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(filename)
+            # Sanitize the client-supplied name once, up front.
+            safe_name = secure_filename(file.filename)
+
+            # Persist the upload (zero-copy via sendfile where possible).
+            filename = os.path.join(app.config['UPLOAD_FOLDER'], safe_name)
+            persist_upload(file.stream, filename)
             logging.info(f"File '{filename}' uploaded successfully.")
 
-            # Process the document using the RAG Processor
-            rag_processor.add_document(filename)
+            # Process the saved copy by path: large PDFs then go through
+            # the process-pool page extraction, which streams can't use
+            # (pool workers re-open the file themselves).
+            rag.add_document(filename)
             logging.info(f"Document '{filename}' processed and added to vector store.")
 
+            # The corpus changed, so cached answers are stale.
+            _note_corpus_changed()
+
             # Optional: Remove the temp file after processing if desired
             # os.remove(filename)
 
-            return jsonify({"message": f"Document '{file.filename}' uploaded and processed successfully."}), 200
+            return ojsonify({"message": f"Document '{file.filename}' uploaded and processed successfully."}, 200)
 
         except Exception as e:
             logging.error(f"Error processing file {file.filename}: {e}", exc_info=True)
-            return jsonify({"error": f"Failed to process file: {str(e)}"}), 500
+            return ojsonify({"error": f"Failed to process file: {str(e)}"}, 500)
     else:
-        return jsonify({"error": "File type not allowed. Please upload .txt or .pdf"}), 400
+        return ojsonify({"error": "File type not allowed. Please upload .txt or .pdf"}, 400)
 
 @app.route('/query', methods=['POST'])
 def query_documents():
@@ -93,27 +416,68 @@ def query_documents():
     API endpoint to ask a question based on the uploaded documents.
     Retrieves relevant context and generates an answer using OpenAI.
     """
-    if rag_processor is None:
-         return jsonify({"error": "RAG Processor not initialized"}), 500
+    try:
+        get_rag()
+    except Exception as e:
+        logging.error(f"Failed to initialize RAG Processor: {e}", exc_info=True)
+        return ojsonify({"error": "RAG Processor not initialized"}, 500)
 
     data = request.get_json()
     if not data or 'query' not in data:
-        return jsonify({"error": "Missing 'query' in request body"}), 400
+        return ojsonify({"error": "Missing 'query' in request body"}, 400)
 
     query_text = data['query']
     logging.info(f"Received query: '{query_text}'")
 
+    # Serve repeated questions straight from the cache.
+    cache_key = _query_cache_key(query_text)
+    cached_answer = query_cache.get(cache_key)
+    if cached_answer is not None:
+        logging.info(f"Answer cache hit for query: '{query_text}'")
+        return ojsonify({"answer": cached_answer}, 200)
+
     try:
-        # Get the answer from the RAG processor
-        answer = rag_processor.answer_query(query_text)
+        # Hand the query to the batch worker and wait for the shared
+        # embedding pass to produce our answer.
+        _ensure_batch_worker()
+        pending = PendingQuery(query_text)
+        _query_queue.put(pending)
+        if not pending.event.wait(timeout=QUERY_TIMEOUT_SECONDS):
+            logging.error(f"Timed out waiting for batched answer to '{query_text}'.")
+            return ojsonify({"error": "Timed out while answering query"}, 504)
+        if pending.error is not None:
+            raise pending.error
+
+        answer = pending.answer
+        if answer == ERROR_ANSWER:
+            # Upstream (OpenAI) failure: surface it as a 502 and keep it
+            # out of the answer cache so the error can't outlive the
+            # outage that produced it.
+            logging.error(f"Upstream answer generation failed for query '{query_text}'.")
+            return ojsonify({"error": answer}, 502)
         logging.info(f"Generated answer: '{answer}'")
-        return jsonify({"answer": answer}), 200
+        query_cache.put(cache_key, answer)
+        return ojsonify({"answer": answer}, 200)
 
     except Exception as e:
         logging.error(f"Error answering query '{query_text}': {e}", exc_info=True)
-        return jsonify({"error": f"Failed to answer query: {str(e)}"}), 500
+        return ojsonify({"error": f"Failed to answer query: {str(e)}"}, 500)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Reports answer-cache hit/miss counters for monitoring.
+    """
+    stats = {"exact": query_cache.stats()}
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.stats()
+    return ojsonify(stats, 200)
 
 # --- Main Execution ---
+# Running `python app.py` starts the single-threaded Werkzeug dev server,
+# which is fine for development. In production run via gunicorn instead
+# (see wsgi.py), so concurrent /upload and /query requests don't serialize:
+#   gunicorn -w 4 -k gthread --threads 4 --preload wsgi:app
 if __name__ == '__main__':
     # Make sure the OpenAI API key is available
     if not os.getenv("OPENAI_API_KEY"):
@@ -122,7 +486,16 @@ if __name__ == '__main__':
     else:
         logging.info("OpenAI API key found.")
 
+    # Warm the model/index in the background while the server binds.
+    start_rag_warmup()
+
     # Run the Flask app
     # Use host='0.0.0.0' to make it accessible on your network
-    # Use debug=True for development (auto-reloads), but turn off for production
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Debug mode (interactive debugger + reloader) only in development:
+    # the reloader re-imports the whole stack - including the FAISS index
+    # and the embedding model - in a second process, doubling startup RAM.
+    debug = os.getenv('FLASK_ENV') == 'development'
+    if not debug:
+        # Keep per-request access logging quiet outside development.
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host='0.0.0.0', port=5000, debug=debug, use_reloader=debug)
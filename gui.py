@@ -3,20 +3,130 @@ from tkinter import ttk # For themed widgets
 from tkinter import filedialog # For open file dialog
 from tkinter import scrolledtext # For scrollable text area
 import os # To get base filename
+import mmap # Page-cache-backed file reads for uploads
 import requests # To make HTTP requests to backend
-import threading # To run network calls in background
-import json # To parse JSON responses
+from requests.adapters import HTTPAdapter, Retry # Connection pooling / retries
+import collections # Deque for coalesced GUI updates
+import queue # Cross-thread UI marshalling queue
+from contextlib import contextmanager # Scoped unlock of the chat widget
+import concurrent.futures # Bounded worker pool for network calls
+import random # Jitter for heartbeat backoff
+import orjson # Fast C JSON parser for backend responses
+import logging # Gated diagnostics (print can block/fail in windowed builds)
+
+# Optional: incremental JSON parsing for large query replies. Without it we
+# fall back to buffering the body and decoding with orjson.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# NullHandler by default: in a frozen/windowed build stdout may be missing
+# or a slow pipe, and a blocking write inside an event callback stalls the
+# UI. __main__ installs a real handler when run from a terminal.
+logger = logging.getLogger("rag_gui")
+logger.addHandler(logging.NullHandler())
 
 # --- Configuration ---
 # Make sure this matches the address your Flask backend is running on
 BACKEND_URL = "http://localhost:5000"
 BACKEND_HEARTBEAT_URL = f"{BACKEND_URL}/heartbeat"
+UPLOAD_URL = f"{BACKEND_URL}/upload"
+QUERY_URL = f"{BACKEND_URL}/query"
+
+# Shared header dict for JSON POSTs - built once, not per query.
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Uploads stream in fixed-size blocks; 1 MiB keeps syscall count low
+# without holding meaningful memory.
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Error message template for HTTP errors, built once instead of assembling
+# f-string pieces on every failed request.
+HTTP_ERR_TEMPLATE = "{what} Error: Backend returned status {code}. Detail: {detail}"
+
+def _parse_json(response):
+    """
+    Decodes a JSON response body with orjson (C parser, no content-type
+    sniffing like response.json() does). Returns None on invalid JSON.
+    """
+    try:
+        return orjson.loads(response.content)
+    except Exception:
+        return None
+
+def _extract_answer(response):
+    """
+    Pulls the 'answer' field out of a streamed /query response.
+
+    With ijson installed the value is parsed incrementally straight off the
+    socket, so a large answer never exists twice in memory (raw body plus
+    parsed object). Without it, the body is buffered and decoded with
+    orjson. Returns None if the body isn't valid JSON or has no answer.
+    """
+    if ijson is not None:
+        try:
+            return next(ijson.items(response.raw, 'answer'), None)
+        except Exception as e:
+            logger.warning(f"Incremental parse of query response failed: {e}")
+            return None
+    body = _parse_json(response)
+    return body.get("answer") if body is not None else None
+
+def _format_network_error(e, url, what):
+    """
+    Maps a requests exception to the user-facing error message.
+
+    Single dispatch point shared by the upload and query threads - the two
+    near-identical except cascades collapsed into one
+    `except requests.exceptions.RequestException` arm calling this.
+
+    Args:
+        e (requests.exceptions.RequestException): The caught exception.
+        url (str): The endpoint the request was sent to.
+        what (str): "Upload" or "Query", used to prefix the message.
+    """
+    # ConnectionError is checked before Timeout: ConnectTimeout subclasses
+    # both, and "is the backend running?" is the more useful message for it.
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return f"{what} Error: Could not connect to the backend at {url}. Is it running?"
+    if isinstance(e, requests.exceptions.Timeout):
+        return f"{what} Error: The request timed out."
+    if isinstance(e, requests.exceptions.HTTPError):
+        error_body = _parse_json(e.response)
+        error_detail = error_body.get("error", "No details provided.") if error_body else "Could not parse error details from response."
+        return HTTP_ERR_TEMPLATE.format(what=what, code=e.response.status_code, detail=error_detail)
+    return f"{what} Error: An unexpected network error occurred: {e}"
 
 class RagAppGUI:
     """
     A Tkinter GUI for interacting with the RAG backend.
     Allows uploading files and asking questions in a chat interface.
     """
+
+    # Chat tag styling, declared once at class level and applied in a single
+    # loop instead of a run of one-shot tag_configure calls at startup.
+    TAG_SPECS = (
+        ("user", {"foreground": "#00008B", "font": ("Helvetica", 10, "bold")}), # Dark Blue
+        ("bot", {"foreground": "#006400"}), # Dark Green
+        ("error", {"foreground": "#DC143C", "font": ("Helvetica", 9, "bold")}), # Crimson Red
+        ("status", {"foreground": "#696969", "font": ("Helvetica", 9, "italic")}), # Dim Gray
+    )
+
+    # (row, weight) pairs for the main window grid: only the chat row (1)
+    # expands vertically.
+    ROW_WEIGHTS = ((0, 0), (1, 1), (2, 0), (3, 0))
+
+    # Heartbeat timing (seconds): retries back off exponentially while the
+    # backend is down, and settle into a slow steady-state check once it's up.
+    HEARTBEAT_BASE_DELAY = 0.5
+    HEARTBEAT_MAX_DELAY = 30.0
+    HEARTBEAT_STEADY_DELAY = 5.0
+
+    # How often the main thread drains the cross-thread UI queue. 30 ms is
+    # well under perception but keeps the pump off the CPU between results.
+    UI_PUMP_INTERVAL_MS = 30
+
     def __init__(self, root):
         """
         Initializes the GUI components.
@@ -28,10 +138,27 @@ class RagAppGUI:
         self.root.title("RAG Document Q&A")
         self.root.geometry("700x600") # Set initial window size
 
-        self.backend_upload_url = f"{BACKEND_URL}/upload"
-        self.backend_query_url = f"{BACKEND_URL}/query"
         self.current_file = None # Store the path of the uploaded file
 
+        # Shared session so HTTP keep-alive reuses one TCP connection across
+        # uploads and queries instead of paying a fresh handshake per call.
+        # Deliberately HTTP/1.1: the Flask/gunicorn backend never negotiates
+        # HTTP/2, so an HTTP/2-capable client (httpx) would add a dependency
+        # without multiplexing anything; concurrent in-flight requests are
+        # instead covered by the adapter's connection pool below.
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(total=2, backoff_factor=0.1)
+        ))
+
+        # Bounded pool of reusable worker threads for all network I/O:
+        # no per-click thread spawn, and rapid clicks queue instead of
+        # stacking up unbounded threads.
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="rag-io")
+
         # --- Style Configuration (Optional) ---
         style = ttk.Style()
         # print(style.theme_names()) # See available themes
@@ -40,10 +167,8 @@ class RagAppGUI:
         # --- Main Frames ---
         # Configure grid layout for the main window
         self.root.columnconfigure(0, weight=1)
-        self.root.rowconfigure(0, weight=0) # Top frame doesn't expand vertically
-        self.root.rowconfigure(1, weight=1) # Middle frame (chat) expands vertically
-        self.root.rowconfigure(2, weight=0) # Bottom frame doesn't expand vertically
-        self.root.rowconfigure(3, weight=0) # Status frame doesn't expand vertically
+        for row, weight in self.ROW_WEIGHTS:
+            self.root.rowconfigure(row, weight=weight)
 
         # Top Frame: File Upload
         self.top_frame = ttk.Frame(self.root, padding="10")
@@ -86,10 +211,8 @@ class RagAppGUI:
         )
         self.chat_display.grid(row=0, column=0, sticky="nsew")
         # Add tags for styling chat messages
-        self.chat_display.tag_configure("user", foreground="#00008B", font=("Helvetica", 10, "bold")) # Dark Blue
-        self.chat_display.tag_configure("bot", foreground="#006400") # Dark Green
-        self.chat_display.tag_configure("error", foreground="#DC143C", font=("Helvetica", 9, "bold")) # Crimson Red
-        self.chat_display.tag_configure("status", foreground="#696969", font=("Helvetica", 9, "italic")) # Dim Gray
+        for tag_name, tag_options in self.TAG_SPECS:
+            self.chat_display.tag_configure(tag_name, **tag_options)
 
         # Bottom Frame Widgets
         self.query_entry = ttk.Entry(self.bottom_frame, width=60, font=("Helvetica", 10))
@@ -102,22 +225,165 @@ class RagAppGUI:
         self.send_button.grid(row=0, column=1)
         self.send_button.config(state=tk.DISABLED) # Start disabled until file is uploaded
 
+        # Widgets toggled together around a backend round-trip, plus a flag
+        # so _set_busy can skip the Tcl dispatches when nothing changes.
+        self._interactive = (self.send_button, self.query_entry, self.upload_button)
+        self._busy = False
+
         # Status Frame Widgets
         self.status_label = ttk.Label(self.status_frame, text="Status: Ready", anchor="w") # Anchor West (left)
         self.status_label.grid(row=0, column=0, sticky="ew")
 
+        # Whether the chat buffer is still empty, tracked so the flush never
+        # has to copy the transcript out of Tk just to decide whether a
+        # blank-line separator is needed before the next message.
+        self._chat_empty = True
+
+        # Pending chat/status updates, coalesced into a single batch applied
+        # on the next idle cycle - a burst (status + user msg + bot msg)
+        # costs one round of Tk work instead of one per update.
+        self._pending_updates = collections.deque()
+        self._flush_scheduled = False
+
+        # Cross-thread marshalling: worker threads put (callable, args)
+        # tuples here instead of issuing one root.after(0, ...) per result.
+        # A single periodic pump drains the queue on the main thread, so a
+        # burst of N results costs one Tcl dispatch per tick instead of N.
+        self._ui_q = queue.Queue()
+        self.root.after(self.UI_PUMP_INTERVAL_MS, self._pump)
+
         # --- Initial Message ---
         self.add_message("Welcome! Please upload a .txt or .pdf document to begin.", "status")
 
+        # Release the pooled connections when the window closes.
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        # Last backend status we reported, to avoid overwriting the status
+        # bar with the same message on every heartbeat tick.
+        self._last_backend_status = None
+
+        # Probe the backend off the main thread so the window appears
+        # immediately instead of blocking up to the probe timeout; the
+        # probe reschedules itself with backoff from then on. Because it
+        # runs over the shared session, this first probe also pre-opens the
+        # keep-alive socket, so the user's first real request reuses a
+        # pooled connection instead of paying the TCP handshake.
+        self._submit_background(self._ping_backend)
+
+    def _submit_background(self, fn, *args):
+        """Runs fn on the worker pool, logging any unhandled exception."""
+        try:
+            future = self.pool.submit(fn, *args)
+        except RuntimeError:
+            return None # Pool already shut down (window closing)
+        future.add_done_callback(self._log_if_exc)
+        return future
+
+    @staticmethod
+    def _log_if_exc(future):
+        """Done-callback: surfaces exceptions that escaped a worker task."""
+        exc = future.exception()
+        if exc is not None:
+            logger.error(f"Background task failed: {exc}", exc_info=exc)
+
+    def _pump(self):
+        """
+        Drains the cross-thread UI queue on the main thread.
+
+        Worker threads enqueue (callable, args) tuples; everything queued
+        since the last tick runs in one pass here, then the pump reschedules
+        itself. This replaces per-result root.after(0, ...) calls, each of
+        which took the Tk interpreter lock separately.
+        """
+        while True:
+            try:
+                fn, args = self._ui_q.get_nowait()
+            except queue.Empty:
+                break
+            fn(*args)
+        self.root.after(self.UI_PUMP_INTERVAL_MS, self._pump)
+
+    def _on_close(self):
+        """Window-close handler: releases workers and connections, then the window."""
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        try:
+            self.session.close()
+        except Exception:
+            pass # Closing anyway; a failed cleanup shouldn't block exit.
+        self.root.destroy()
+
+    def _ping_backend(self, delay=None):
+        """
+        Backend liveness probe, run on a worker thread.
+
+        While the backend is unreachable the retry delay grows by 1.5x per
+        attempt (plus a little jitter so restarted clients don't retry in
+        lockstep), capped at HEARTBEAT_MAX_DELAY - far fewer wasted sockets
+        than a fixed-interval poll, while still picking the backend up
+        quickly when it returns. A success resets the backoff and the loop
+        settles into a slow steady-state check.
+        """
+        if delay is None:
+            delay = self.HEARTBEAT_BASE_DELAY
+        try:
+            response = self.session.get(BACKEND_HEARTBEAT_URL, timeout=(1, 2))
+            ok = response.status_code == 200
+            if ok:
+                message = "Backend connected. Ready."
+            else:
+                message = f"Backend responded with status {response.status_code}."
+        except requests.exceptions.RequestException:
+            ok = False
+            message = f"Could not reach backend at {BACKEND_HEARTBEAT_URL}. Is it running?"
+
+        if ok:
+            next_delay = self.HEARTBEAT_BASE_DELAY
+            wait = self.HEARTBEAT_STEADY_DELAY
+        else:
+            next_delay = min(self.HEARTBEAT_MAX_DELAY, delay * 1.5) + random.uniform(0, delay * 0.1)
+            wait = next_delay
+
+        # Only touch the status bar when the backend state actually changes.
+        if message != self._last_backend_status:
+            self._last_backend_status = message
+            logger.info(message)
+            self._ui_q.put((self.update_status, (message,)))
+
+        # Arm the next probe via the queue so the Tk timer is registered on
+        # the main thread rather than from this worker.
+        self._ui_q.put((self.root.after,
+                        (int(wait * 1000),
+                         lambda: self._submit_background(self._ping_backend, next_delay))))
+
+    def _set_busy(self, busy):
+        """
+        Locks or unlocks the interactive widgets in one pass.
+
+        Collapses the scattered per-widget .config(state=...) toggles into a
+        single loop (one Tcl command per widget) and skips the whole round
+        when the busy state hasn't actually changed. When unlocking, the
+        send button stays disabled until a document has been processed.
+        """
+        if busy == self._busy:
+            return
+        state = tk.DISABLED if busy else tk.NORMAL
+        for widget in self._interactive:
+            widget.config(state=state)
+        self._busy = busy
+        if not busy and not self.current_file:
+            self.send_button.config(state=tk.DISABLED)
+
     # --- File Upload Methods ---
 
     def select_and_upload_file(self):
         """Opens file dialog, updates label, and starts upload thread."""
-        if self.upload_button['state'] == tk.DISABLED:
+        if self._busy:
              self.update_status("Please wait for the current operation to complete.")
              return # Avoid concurrent uploads
 
-        self.update_status("Selecting file...")
+        # Forced: the modal dialog below blocks the mainloop, so a queued
+        # update wouldn't be painted until the dialog closes.
+        self.force_status("Selecting file...")
         filepath = filedialog.askopenfilename(
             title="Select a Document",
             filetypes=(("Text files", "*.txt"), ("PDF files", "*.pdf"), ("All files", "*.*"))
@@ -131,12 +397,10 @@ class RagAppGUI:
         self.file_label.config(text=f"Selected: {filename}")
         self.add_message(f"Attempting to upload '{filename}'...", "status")
         self.update_status(f"Uploading {filename}...")
-        self.send_button.config(state=tk.DISABLED) # Disable send while uploading
-        self.upload_button.config(state=tk.DISABLED) # Disable upload while uploading
+        self._set_busy(True) # Lock the input widgets while uploading
 
-        # Run the upload in a separate thread to avoid freezing the GUI
-        upload_thread = threading.Thread(target=self._upload_file_thread, args=(filepath, filename), daemon=True)
-        upload_thread.start()
+        # Run the upload on the worker pool to avoid freezing the GUI
+        self._submit_background(self._upload_file_thread, filepath, filename)
 
     def _upload_file_thread(self, filepath, filename):
         """
@@ -147,46 +411,76 @@ class RagAppGUI:
             filename (str): The base name of the file.
         """
         try:
-            with open(filepath, 'rb') as f:
-                files = {'file': (filename, f)}
-                # Increased timeout for potentially large uploads/processing
-                response = requests.post(self.backend_upload_url, files=files, timeout=300)
-                response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+            # Stream the file as a raw chunked body instead of a
+            # multipart form: requests uses chunked transfer encoding
+            # for generators, so upload starts immediately, no full-file
+            # read or Content-Length pass is needed, and memory stays
+            # flat regardless of file size. The backend gets the name
+            # from X-Filename.
+            total_bytes = os.path.getsize(filepath)
+            progress = self._make_upload_progress_callback(filename, total_bytes)
+
+            def file_chunks():
+                # mmap slicing serves each block straight from the page
+                # cache without a read() syscall per chunk. Slices are
+                # bytes, not memoryviews: urllib3's send loop keeps a
+                # reference to the last yielded chunk, and an exported
+                # memoryview would make mm.close() raise BufferError and
+                # abort the upload. Empty files cannot be mmapped, but
+                # they also have nothing to yield.
+                if not total_bytes:
+                    return
+                with open(filepath, 'rb') as f, \
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for offset in range(0, total_bytes, UPLOAD_CHUNK_SIZE):
+                        yield mm[offset:offset + UPLOAD_CHUNK_SIZE]
+                        progress(min(offset + UPLOAD_CHUNK_SIZE, total_bytes))
+
+            # (connect, read) timeout pair: fail fast if the backend is
+            # down, but allow long processing before the response.
+            response = self.session.post(
+                UPLOAD_URL,
+                data=file_chunks(),
+                headers={'Content-Type': 'application/octet-stream', 'X-Filename': filename},
+                timeout=(10, 300)
+            )
+            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+
+            # Process successful response
+            response_json = _parse_json(response)
+            if response_json is not None:
+                message = response_json.get("message", "Upload successful, but no message received.")
+                # Schedule GUI update back on the main thread
+                self._ui_q.put((self._update_gui_after_upload, (True, message, filename)))
+            else:
+                 # Handle cases where response is not JSON
+                 self._ui_q.put((self._update_gui_after_upload, (True, f"Upload successful (Status {response.status_code}), but response was not valid JSON.", filename)))
 
-                # Process successful response
-                try:
-                    response_json = response.json()
-                    message = response_json.get("message", "Upload successful, but no message received.")
-                    # Schedule GUI update back on the main thread
-                    self.root.after(0, self._update_gui_after_upload, True, message, filename)
-                except json.JSONDecodeError:
-                     # Handle cases where response is not JSON
-                     self.root.after(0, self._update_gui_after_upload, True, f"Upload successful (Status {response.status_code}), but response was not valid JSON.", filename)
-
-        except requests.exceptions.ConnectionError:
-            error_message = f"Upload Error: Could not connect to the backend at {self.backend_upload_url}. Is it running?"
-            self.root.after(0, self._update_gui_after_upload, False, error_message, filename)
-        except requests.exceptions.Timeout:
-             error_message = f"Upload Error: The request timed out while uploading {filename}."
-             self.root.after(0, self._update_gui_after_upload, False, error_message, filename)
-        except requests.exceptions.HTTPError as e:
-             # Handle specific HTTP errors reported by the backend
-             error_message = f"Upload Error: Backend returned status {e.response.status_code}."
-             try:
-                 # Try to get error detail from backend JSON response
-                 error_detail = e.response.json().get("error", "No details provided.")
-                 error_message += f" Detail: {error_detail}"
-             except json.JSONDecodeError:
-                 error_message += " Could not parse error details from response."
-             self.root.after(0, self._update_gui_after_upload, False, error_message, filename)
         except requests.exceptions.RequestException as e:
-            # Catch other potential requests errors
-            error_message = f"Upload Error: An unexpected network error occurred: {e}"
-            self.root.after(0, self._update_gui_after_upload, False, error_message, filename)
+            # All network failures funnel through the shared formatter.
+            error_message = _format_network_error(e, UPLOAD_URL, "Upload")
+            self._ui_q.put((self._update_gui_after_upload, (False, error_message, filename)))
         except Exception as e:
             # Catch other potential errors (e.g., file reading issues)
             error_message = f"Upload Error: An unexpected error occurred: {e}"
-            self.root.after(0, self._update_gui_after_upload, False, error_message, filename)
+            self._ui_q.put((self._update_gui_after_upload, (False, error_message, filename)))
+
+    def _make_upload_progress_callback(self, filename, total_bytes):
+        """
+        Builds a callback taking a bytes-sent count that updates the status
+        bar (via the main thread) at 5% progress steps.
+        """
+        last_percent = [-1] # Mutable cell so the closure can update it
+
+        def callback(bytes_sent):
+            if not total_bytes:
+                return
+            percent = int(bytes_sent * 100 / total_bytes)
+            if percent % 5 == 0 and percent != last_percent[0]:
+                last_percent[0] = percent
+                self._ui_q.put((self.update_status, (f"Uploading {filename}... {percent}%",)))
+
+        return callback
 
     def _update_gui_after_upload(self, success, message, filename):
         """
@@ -196,7 +490,6 @@ class RagAppGUI:
         if success:
             self.update_status(f"Successfully processed '{filename}'. Ready to chat.")
             self.add_message(f"'{filename}' processed successfully.", "status")
-            self.send_button.config(state=tk.NORMAL) # Enable send button
             self.query_entry.focus_set() # Set focus to query entry
         else:
             self.update_status(f"Failed to process '{filename}'. See details below.")
@@ -204,14 +497,15 @@ class RagAppGUI:
             self.file_label.config(text="No file selected.") # Reset file label on error
             self.current_file = None # Reset current file on error
 
-        self.upload_button.config(state=tk.NORMAL) # Re-enable upload button
+        # Unlock the inputs; _set_busy keeps send disabled if no file loaded.
+        self._set_busy(False)
 
 
     # --- Query Methods ---
 
     def send_query(self, event=None): # Add event=None for key binding
         """Handles sending the query typed by the user."""
-        if self.send_button['state'] == tk.DISABLED:
+        if self._busy or not self.current_file:
              self.update_status("Please wait for the current operation or upload a file first.")
              return
 
@@ -225,13 +519,10 @@ class RagAppGUI:
 
         # Update status and disable input widgets
         self.update_status("Querying backend...")
-        self.send_button.config(state=tk.DISABLED)
-        self.query_entry.config(state=tk.DISABLED)
-        self.upload_button.config(state=tk.DISABLED) # Also disable upload during query
+        self._set_busy(True)
 
-        # Start background thread for backend communication
-        query_thread = threading.Thread(target=self._query_backend_thread, args=(query,), daemon=True)
-        query_thread.start()
+        # Run the query on the worker pool
+        self._submit_background(self._query_backend_thread, query)
 
     def _query_backend_thread(self, query):
         """
@@ -241,46 +532,38 @@ class RagAppGUI:
             query (str): The user's query text.
         """
         try:
-            payload = {'query': query}
-            headers = {'Content-Type': 'application/json'}
-            # Increased timeout for potentially complex queries
-            response = requests.post(self.backend_query_url, json=payload, headers=headers, timeout=180)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+            # Encode the payload with orjson rather than letting requests
+            # run it through the pure-Python json.dumps; responses are
+            # already decoded with orjson in _parse_json.
+            payload = orjson.dumps({'query': query})
+            # stream=True defers the body read so it can be parsed straight
+            # off the socket; the with block returns the connection to the
+            # pool even on an early exit. (connect, read) timeout pair.
+            with self.session.post(QUERY_URL, data=payload, headers=JSON_HEADERS,
+                                   stream=True, timeout=(10, 180)) as response:
+                if response.status_code >= 400:
+                    # Buffer the (small) error body now, so the HTTPError
+                    # handler can still read the detail once the streamed
+                    # response has been closed.
+                    response.content
+                response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+                answer = _extract_answer(response)
 
-            # Process successful response
-            try:
-                response_json = response.json()
-                answer = response_json.get("answer", "Backend returned success, but no answer found.")
+            if answer is not None:
                 # Schedule GUI update back on the main thread
-                self.root.after(0, self._update_gui_after_query, True, answer)
-            except json.JSONDecodeError:
-                 # Handle cases where response is not JSON
-                 self.root.after(0, self._update_gui_after_query, False, f"Query Error: Backend response was not valid JSON (Status {response.status_code}).")
-
-        except requests.exceptions.ConnectionError:
-            error_message = f"Query Error: Could not connect to the backend at {self.backend_query_url}. Is it running?"
-            self.root.after(0, self._update_gui_after_query, False, error_message)
-        except requests.exceptions.Timeout:
-             error_message = "Query Error: The request timed out while querying the backend."
-             self.root.after(0, self._update_gui_after_query, False, error_message)
-        except requests.exceptions.HTTPError as e:
-             # Handle specific HTTP errors reported by the backend
-             error_message = f"Query Error: Backend returned status {e.response.status_code}."
-             try:
-                 # Try to get error detail from backend JSON response
-                 error_detail = e.response.json().get("error", "No details provided.")
-                 error_message += f" Detail: {error_detail}"
-             except json.JSONDecodeError:
-                 error_message += " Could not parse error details from response."
-             self.root.after(0, self._update_gui_after_query, False, error_message)
+                self._ui_q.put((self._update_gui_after_query, (True, answer)))
+            else:
+                 # Handle cases where response is not JSON / has no answer
+                 self._ui_q.put((self._update_gui_after_query, (False, f"Query Error: Backend response was not valid JSON (Status {response.status_code}).")))
+
         except requests.exceptions.RequestException as e:
-            # Catch other potential requests errors
-            error_message = f"Query Error: An unexpected network error occurred: {e}"
-            self.root.after(0, self._update_gui_after_query, False, error_message)
+            # All network failures funnel through the shared formatter.
+            error_message = _format_network_error(e, QUERY_URL, "Query")
+            self._ui_q.put((self._update_gui_after_query, (False, error_message)))
         except Exception as e:
             # Catch other potential errors
             error_message = f"Query Error: An unexpected error occurred: {e}"
-            self.root.after(0, self._update_gui_after_query, False, error_message)
+            self._ui_q.put((self._update_gui_after_query, (False, error_message)))
 
 
     def _update_gui_after_query(self, success, message):
@@ -295,64 +578,100 @@ class RagAppGUI:
             self.add_message(message, "error") # Display the error message in chat
             self.update_status("Error occurred during query.")
 
-        # Re-enable input widgets regardless of success/failure
-        # Only enable send if a file is still considered loaded
-        if self.current_file:
-             self.send_button.config(state=tk.NORMAL)
-        else:
-             self.send_button.config(state=tk.DISABLED)
-        self.query_entry.config(state=tk.NORMAL)
-        self.upload_button.config(state=tk.NORMAL) # Re-enable upload
+        # Re-enable input widgets regardless of success/failure; _set_busy
+        # keeps send disabled if no file is considered loaded.
+        self._set_busy(False)
         self.query_entry.focus_set() # Set focus back to query entry
 
 
     # --- Utility Methods ---
 
     def add_message(self, message, tag):
-        """Adds a message to the chat display with specified tag for styling."""
-        self.chat_display.config(state='normal') # Enable editing
-        # Add message and ensure separation with newlines
-        current_content = self.chat_display.get('1.0', tk.END).strip()
-        if current_content: # Add newline only if content exists
-             self.chat_display.insert(tk.END, '\n\n')
+        """Queues a chat message with a styling tag; applied on the next coalesced flush."""
+        self._pending_updates.append(('msg', message, tag))
+        self._schedule_flush()
 
-        self.chat_display.insert(tk.END, message, tag)
-        self.chat_display.config(state='disabled') # Disable editing
-        self.chat_display.see(tk.END) # Scroll to the bottom
+    def update_status(self, message):
+        """Queues a status bar update; applied on the next coalesced flush."""
+        self._pending_updates.append(('status', message))
+        self._schedule_flush()
 
+    def force_status(self, message):
+        """
+        Applies a status update (plus anything already queued) right now.
+        Only for callers that block the mainloop immediately afterwards -
+        e.g. opening a modal dialog - where the idle flush wouldn't get a
+        chance to run first. Everything else should use update_status.
+        """
+        self.update_status(message)
+        self._flush_updates()
+        self.root.update_idletasks()
 
-    def update_status(self, message):
-        """Updates the status bar label."""
-        self.status_label.config(text=f"Status: {message}")
-        self.root.update_idletasks() # Force GUI update
+    @contextmanager
+    def _editable_chat(self):
+        """
+        Temporarily unlocks the read-only chat widget so a whole batch of
+        inserts pays for one normal/disabled state flip instead of one pair
+        per message.
+        """
+        self.chat_display.config(state='normal')
+        try:
+            yield
+        finally:
+            self.chat_display.config(state='disabled')
+
+    def _schedule_flush(self):
+        """Arranges a single _flush_updates call on the next idle cycle."""
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.root.after_idle(self._flush_updates)
+
+    def _flush_updates(self):
+        """
+        Applies every queued chat/status update in one Tk interaction:
+        the chat widget is unlocked once, all messages inserted, locked and
+        scrolled once; only the last queued status string wins.
+        """
+        self._flush_scheduled = False
+        if not self._pending_updates:
+            return
+
+        messages = []
+        status_text = None
+        while self._pending_updates:
+            update = self._pending_updates.popleft()
+            if update[0] == 'msg':
+                messages.append((update[1], update[2]))
+            else:
+                status_text = update[1]
+
+        if messages:
+            with self._editable_chat():
+                for message, tag in messages:
+                    # Separate from the previous message without scanning the
+                    # buffer - the emptiness flag keeps this O(1) in chat length.
+                    if self._chat_empty:
+                        self.chat_display.insert(tk.END, message, (tag,))
+                        self._chat_empty = False
+                    else:
+                        self.chat_display.insert(tk.END, '\n\n' + message, (tag,))
+            self.chat_display.see(tk.END) # Scroll to the bottom
+
+        if status_text is not None:
+            # No forced update_idletasks(): Tk repaints on the next mainloop
+            # iteration anyway.
+            self.status_label.config(text=f"Status: {status_text}")
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    # --- Backend Check (Optional but helpful) ---
-    backend_ok = False
-    try:
-        # Simple check if backend root is reachable before starting GUI
-        ping_response = requests.get(BACKEND_HEARTBEAT_URL, timeout=2)
-        if ping_response.status_code == 200 or ping_response.status_code == 404: # Allow 404 on root
-             print(f"Backend detected at {BACKEND_HEARTBEAT_URL}")
-             backend_ok = True
-        else:
-             print(f"Warning: Backend responded with status {ping_response.status_code} at {BACKEND_HEARTBEAT_URL}")
-             # Decide if you want to proceed even if backend isn't fully responsive
-             # backend_ok = True # Uncomment to proceed anyway
-    except requests.exceptions.ConnectionError:
-        print(f"Error: Could not connect to backend at {BACKEND_HEARTBEAT_URL}. Please ensure it's running.")
-    except requests.exceptions.Timeout:
-        print(f"Error: Connection to backend timed out ({BACKEND_HEARTBEAT_URL}).")
-    except Exception as e:
-        print(f"An unexpected error occurred during backend check: {e}")
-
-    # Only start GUI if backend seems okay (or if you decide to ignore the check)
-    # if backend_ok: # Uncomment this line to enforce backend check
+    # Terminal run: wire the module logger to stderr.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # The backend check happens on a background thread inside RagAppGUI
+    # (see _ping_backend), so the window shows instantly even when the
+    # backend is down or slow to answer.
     root = tk.Tk()
     app = RagAppGUI(root)
     root.mainloop()
-    # else: # Uncomment this block to enforce backend check
-    #     print("Exiting GUI application because backend check failed.")
 
@@ -0,0 +1,14 @@
+"""
+Gunicorn configuration (picked up automatically from the working directory).
+
+The only hook here starts the RAG warm-up per worker, after the fork.
+Starting it at import time instead would deadlock under --preload: the
+master's warm-up thread holds the init lock while gunicorn forks, and the
+children inherit a locked lock with no thread left to release it.
+"""
+
+
+def post_fork(server, worker):
+    """Starts the background model/index warm-up inside each worker."""
+    from app import start_rag_warmup
+    start_rag_warmup()
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import faiss
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with TTL expiry for query answers.
+
+    Identical questions are very common in a chat UI (retries, FAQ-style
+    queries), and each one otherwise pays for an embedding pass, a FAISS
+    search, and an OpenAI completion. A hit here is just a dict lookup.
+    Entries are evicted least-recently-used once max_size is reached and
+    ignored once older than ttl_seconds. The whole cache is invalidated
+    whenever the document corpus changes.
+    """
+    def __init__(self, max_size=2000, ttl_seconds=300):
+        """
+        Args:
+            max_size (int): Maximum number of cached answers before LRU eviction.
+            ttl_seconds (float): How long a cached answer stays valid.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (timestamp, value)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached value for key, or None on miss/expiry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            timestamp, value = entry
+            if time.monotonic() - timestamp > self.ttl_seconds:
+                # Expired - drop it so it doesn't linger.
+                del self._entries[key]
+                self.misses += 1
+                return None
+            # Mark as recently used.
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores a value, evicting the least-recently-used entry if full."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (time.monotonic(), value)
+            while len(self._entries) > self.max_size:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logging.debug(f"QueryCache evicted entry {evicted_key!r}.")
+
+    def invalidate(self):
+        """Drops every cached entry (e.g. after the corpus changes)."""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            logging.info(f"QueryCache invalidated ({count} entries dropped).")
+
+    def stats(self):
+        """Returns hit/miss counters and current size for monitoring."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+class SemanticQueryCache:
+    """
+    Near-duplicate answer cache based on embedding similarity.
+
+    Exact-match caching misses paraphrased questions ("what is a rocket?"
+    vs "what's a rocket?") even though the answer would be identical. This
+    cache keeps the normalized embeddings of recently answered queries in a
+    small FAISS inner-product index; if a new query's cosine similarity to
+    any cached query clears the threshold, the stored answer is returned
+    without an LLM round-trip. Entries are evicted oldest-first once the
+    capacity is reached.
+    """
+    def __init__(self, embedding_dim, capacity=1024, similarity_threshold=0.9):
+        """
+        Args:
+            embedding_dim (int): Dimension of the query embeddings.
+            capacity (int): Maximum number of cached (embedding, answer) pairs.
+            similarity_threshold (float): Minimum cosine similarity to count as a hit.
+        """
+        self.capacity = capacity
+        self.similarity_threshold = similarity_threshold
+        # Inner product over normalized vectors == cosine similarity.
+        self._index = faiss.IndexFlatIP(embedding_dim)
+        self._answers = deque()  # Position i holds the answer for index id i.
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        """Returns a normalized float32 (1, dim) copy of the embedding."""
+        vector = np.array(embedding, dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def get(self, embedding):
+        """Returns the cached answer for a similar-enough query, or None."""
+        with self._lock:
+            if self._index.ntotal == 0:
+                self.misses += 1
+                return None
+            scores, ids = self._index.search(self._normalize(embedding), 1)
+            if scores[0][0] >= self.similarity_threshold:
+                self.hits += 1
+                return self._answers[int(ids[0][0])]
+            self.misses += 1
+            return None
+
+    def put(self, embedding, answer):
+        """Caches an answer under the query's embedding, evicting the oldest entry if full."""
+        with self._lock:
+            if self._index.ntotal >= self.capacity:
+                # Drop the oldest entry; FAISS compacts ids downward on
+                # removal, which keeps them aligned with the answer deque.
+                self._index.remove_ids(np.array([0], dtype='int64'))
+                self._answers.popleft()
+            self._index.add(self._normalize(embedding))
+            self._answers.append(answer)
+
+    def invalidate(self):
+        """Drops every cached entry (e.g. after the corpus changes)."""
+        with self._lock:
+            count = self._index.ntotal
+            self._index.reset()
+            self._answers.clear()
+            logging.info(f"SemanticQueryCache invalidated ({count} entries dropped).")
+
+    def stats(self):
+        """Returns hit/miss counters and current size for monitoring."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": int(self._index.ntotal),
+                "capacity": self.capacity,
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -1,7 +1,15 @@
+import hashlib
 import os
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
 import numpy as np
 import faiss
+import torch
+import pyarrow as pa
+import requests
 from pypdf import PdfReader
 from sentence_transformers import SentenceTransformer
 from openai import OpenAI
@@ -10,26 +18,269 @@ import pickle # To save/load Python objects (like the doc list)
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Index selection is tiered: flat -> IVFFlat -> HNSW as the corpus grows.
+# The top tier is an HNSW graph index (sub-linear approximate search,
+# negligible recall loss), entered once the corpus passes this many chunks.
+HNSW_MIN_CHUNKS = 50_000
+HNSW_NEIGHBORS = 32
+HNSW_EF_CONSTRUCTION = 40
+HNSW_EF_SEARCH = 16
+
+# Optional compressed index for very large corpora (index_type='ivf-rq'):
+# IVF pruning scans only nprobe/nlist of the corpus per query, and the
+# residual quantizer encodes each vector in 16 bytes plus an 8-bit norm
+# instead of d*4 bytes of raw fp32. IVF indexes need a training pass, so
+# vectors are buffered until enough samples have accumulated.
+IVF_RQ_FACTORY = "IVF4096,RQ16x8_Nqint8"
+IVF_RQ_NLIST = 4096
+IVF_RQ_TRAIN_PER_LIST = 40  # Recommended minimum training points per list
+IVF_NPROBE = 16
+
+# Chunk token ids are cached to disk as an int32 [N, max_len] array so an
+# index rebuild (e.g. after an embedding-model switch) only needs the
+# model forward pass - no re-extraction, re-chunking or re-tokenization.
+TOKEN_CACHE_MAX_LEN = 256
+
+# Mid-size tier between flat and HNSW: past this many vectors the store
+# is rebuilt once as IVFFlat (exact vectors kept, but only nprobe of
+# ~sqrt(N) clusters scanned per query). The rebuild runs at save time so
+# queries never pay for the retraining. Brute-force flat search stays
+# fastest (and exact) below this size.
+IVFFLAT_MIN_CHUNKS = 10_000
+
+# Ingest encodes chunks in mini-batches of this size so the FAISS add of
+# batch k can run on a worker thread while batch k+1 is being encoded.
+INGEST_ENCODE_BATCH = 256
+
+# Appending a document writes only a small numbered shard (new chunks +
+# new vectors) instead of rewriting the whole store, so bulk ingest is
+# O(N) rather than O(N^2). Shards fold into the base files once this many
+# have accumulated.
+SHARD_COMPACT_THRESHOLD = 16
+
+# PDFs with at least this many pages are extracted by a process pool;
+# smaller ones finish faster sequentially than the workers take to spawn.
+PDF_PARALLEL_MIN_PAGES = 8
+
+# Returned in place of an answer when the OpenAI call fails. Exposed as a
+# constant so callers (app.py) can recognize failures and keep them out of
+# the answer caches - a cached error would outlive the outage that caused it.
+ERROR_ANSWER = "Sorry, I encountered an error while trying to generate an answer."
+
+
+def _chunk_digest(text):
+    """64-bit digest of a chunk's text, used for ingest-time dedupe."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+
+
+class _ReadWriteLock:
+    """
+    Readers-writer lock guarding the FAISS index: any number of concurrent
+    searches (readers), but index mutation (add, train, swap) is exclusive.
+    FAISS does not allow add/search concurrency on the same index, and under
+    gunicorn's threaded workers an /upload can mutate the index while the
+    query path searches it.
+
+    The write side is reentrant for its owning thread, so nested mutation
+    helpers (e.g. _ensure_writable_index inside a locked add) don't deadlock.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None # Thread currently holding the write lock
+        self._write_depth = 0
+
+    @contextmanager
+    def read_locked(self):
+        """Acquires shared (search) access for the duration of the block."""
+        me = threading.current_thread()
+        with self._cond:
+            while self._writer is not None and self._writer is not me:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_locked(self):
+        """Acquires exclusive (mutation) access for the duration of the block."""
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is me:
+                self._write_depth += 1
+            else:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._writer = me
+                self._write_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+# Batch size for requests to a remote TEI embedding server; the server
+# re-batches internally, so this mostly bounds request payload size.
+TEI_BATCH_SIZE = 256
+
+
+class TEIEmbeddingClient:
+    """
+    Drop-in encode() backend that posts to a Hugging Face Text Embeddings
+    Inference (TEI) server instead of running the model in-process.
+
+    TEI does token-based continuous batching server-side, so one GPU can
+    saturate under load from every gunicorn worker at once. Only the parts
+    of the SentenceTransformer surface this module uses are provided:
+    encode() and get_sentence_embedding_dimension(). Tokenizer-dependent
+    features (token-budget chunking, the token-id cache) detect the missing
+    tokenizer attribute and fall back on their own. Enabled by setting the
+    TEI_URL environment variable.
+    """
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session() # Keep-alive across batches
+        # Probe once for the dimension, so construction fails fast when
+        # the server is unreachable (mirrors a failed model load).
+        self._dimension = len(self._embed_batch(["dimension probe"])[0])
+        logging.info(f"Using TEI embedding server at {self.base_url} (dimension {self._dimension}).")
+
+    def _embed_batch(self, texts):
+        """Embeds one batch of texts via the server's /embed endpoint."""
+        response = self.session.post(f"{self.base_url}/embed",
+                                     json={"inputs": texts}, timeout=120)
+        response.raise_for_status()
+        return response.json()
+
+    def encode(self, sentences, batch_size=TEI_BATCH_SIZE, **kwargs):
+        """Embeds sentences remotely; mirrors SentenceTransformer.encode output."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        vectors = []
+        for start in range(0, len(sentences), batch_size):
+            vectors.extend(self._embed_batch(sentences[start:start + batch_size]))
+        result = np.asarray(vectors, dtype='float32')
+        return result[0] if single else result
+
+    def get_sentence_embedding_dimension(self):
+        """Returns the embedding dimension reported by the server."""
+        return self._dimension
+
+
+def _extract_and_chunk(file_path):
+    """
+    Bulk-ingest worker: extracts and chunks one file.
+
+    Module-level so ProcessPoolExecutor can pickle it. Extraction is
+    sequential here - each file is already its own unit of parallelism -
+    and the embedding model stays out of the workers entirely; only the
+    parent encodes.
+
+    Returns:
+        tuple[list[str], str]: The file's chunks and its base filename.
+    """
+    filename = os.path.basename(file_path)
+    text = ""
+    try:
+        if filename.lower().endswith('.pdf'):
+            reader = PdfReader(file_path)
+            # Same empty-page fast path as _extract_text_from_pdf.
+            text = "\n".join(page.extract_text() or "" for page in reader.pages
+                             if page.get("/Contents") is not None)
+        elif filename.lower().endswith('.txt'):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        else:
+            logging.warning(f"Unsupported file type skipped: {filename}")
+    except Exception as e:
+        logging.error(f"Failed to extract text from {file_path}: {e}", exc_info=True)
+    if not text:
+        return [], filename
+    return RAGProcessor._split_text_into_chunks(text), filename
+
+
+def _pdf_page_text(file_path, page_index):
+    """
+    Extracts the text of a single PDF page.
+
+    Module-level so it can be pickled into ProcessPoolExecutor workers.
+    Each worker call re-opens the file; that is cheap next to pypdf's
+    CPU-bound per-page content parsing, which is what we parallelize.
+    """
+    try:
+        return PdfReader(file_path).pages[page_index].extract_text() or ""
+    except Exception as e:
+        logging.error(f"Failed to extract page {page_index} of {file_path}: {e}")
+        return ""
+
 class RAGProcessor:
     """
     Handles document processing, embedding, vector storage, retrieval,
     and interaction with OpenAI for RAG-based question answering.
     """
-    def __init__(self, embedding_model_name='all-MiniLM-L6-v2', vector_store_path='data/vector_store'):
+    def __init__(self, embedding_model_name='all-MiniLM-L6-v2', vector_store_path='data/vector_store',
+                 index_type='flat'):
         """
         Initializes the RAG Processor.
 
         Args:
             embedding_model_name (str): Name of the Sentence Transformer model to use.
             vector_store_path (str): Directory to save/load the FAISS index and document chunks.
+            index_type (str): 'flat' (default; exact search, auto-upgraded to
+                HNSW as the corpus grows) or 'ivf-rq' (compressed IVF index
+                for multi-million-chunk corpora; needs a training pass before
+                vectors become searchable).
         """
+        self.index_type = index_type
         self.vector_store_path = vector_store_path
         self.index_file = os.path.join(vector_store_path, 'faiss_index.idx')
-        self.doc_chunks_file = os.path.join(vector_store_path, 'doc_chunks.pkl')
+        self.doc_chunks_file = os.path.join(vector_store_path, 'doc_chunks.arrow')
+        # Pre-Arrow stores pickled the chunk list; still readable on load.
+        self.legacy_chunks_file = os.path.join(vector_store_path, 'doc_chunks.pkl')
+        self.token_ids_file = os.path.join(vector_store_path, 'token_ids.npy')
+        # Embeddings buffered for IVF training, mirrored to disk (see
+        # _buffer_for_training) so a restart can't orphan their chunks.
+        self.train_buffer_file = os.path.join(vector_store_path, 'train_buffer.npy')
 
         logging.info(f"Loading embedding model: {embedding_model_name}")
         try:
-            self.embedding_model = SentenceTransformer(embedding_model_name)
+            tei_url = os.getenv("TEI_URL")
+            if tei_url:
+                # Remote embedding server: encode() goes over HTTP and the
+                # heavy model never loads in this process.
+                self.embedding_model = TEIEmbeddingClient(tei_url)
+            elif torch.cuda.is_available():
+                # fp16 halves memory bandwidth and roughly doubles matmul
+                # throughput on GPU at negligible accuracy loss for this
+                # model. CPU stays fp32: half-precision compute is slower
+                # there without dedicated hardware support.
+                self.embedding_model = SentenceTransformer(
+                    embedding_model_name,
+                    device='cuda',
+                    model_kwargs={'torch_dtype': torch.float16}
+                )
+                logging.info("Embedding model running on CUDA in float16.")
+            else:
+                # ONNX backend on CPU: fused kernels beat eager PyTorch by
+                # 2-4x for encode throughput, with an identical .encode()
+                # API. Requires the optional onnx extra of
+                # sentence-transformers; fall back to torch without it.
+                try:
+                    self.embedding_model = SentenceTransformer(embedding_model_name, backend="onnx")
+                    logging.info("Embedding model running on CPU via ONNX backend.")
+                except Exception as onnx_error:
+                    logging.warning(f"ONNX backend unavailable ({onnx_error}); using the torch backend.")
+                    self.embedding_model = SentenceTransformer(embedding_model_name)
             # Get embedding dimension dynamically
             self.embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
             logging.info(f"Embedding model loaded. Dimension: {self.embedding_dim}")
@@ -46,17 +297,51 @@ class RAGProcessor:
         # Load existing vector store or initialize a new one
         self.index = None
         self.doc_chunks = [] # List to store {'text': chunk_text, 'source': filename}
+        self._train_buffer = [] # Embedding arrays waiting for IVF training
+        self._gpu_res = None # faiss GPU resources, allocated once on first use
+        self._on_gpu = False # Whether self.index currently lives on a GPU
+        self._index_read_only = False # True while self.index is an mmap view
+        # Searches share the index; mutation (add/train/swap) is exclusive.
+        self._index_lock = _ReadWriteLock()
+        # One document ingest mutates the store at a time (see _index_text).
+        self._ingest_lock = threading.Lock()
         self._load_vector_store()
+        # Snapshot of the newest on-disk store mtime, for refresh_if_stale.
+        self._store_files_mtime = self._store_mtime()
+
+        # Digests of every indexed chunk, so boilerplate that repeats
+        # across documents (headers, footers, legal notices) is embedded
+        # and stored only once.
+        self._chunk_hashes = {_chunk_digest(chunk['text']) for chunk in self.doc_chunks}
 
     def _load_vector_store(self):
         """Loads the FAISS index and document chunks from disk if they exist."""
         try:
-            if os.path.exists(self.index_file) and os.path.exists(self.doc_chunks_file):
+            have_chunks = os.path.exists(self.doc_chunks_file) or os.path.exists(self.legacy_chunks_file)
+            if os.path.exists(self.index_file) and have_chunks:
                 logging.info(f"Loading FAISS index from {self.index_file}")
-                self.index = faiss.read_index(self.index_file)
-                logging.info(f"Loading document chunks from {self.doc_chunks_file}")
-                with open(self.doc_chunks_file, 'rb') as f:
-                    self.doc_chunks = pickle.load(f)
+                try:
+                    # Memory-map instead of copying the whole file onto the
+                    # heap: startup is near-instant, RSS stays flat, and the
+                    # page cache is shared across gunicorn workers. Writes
+                    # promote to an owning copy lazily (_ensure_writable_index).
+                    self.index = faiss.read_index(self.index_file,
+                                                  faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                    self._index_read_only = True
+                except Exception as mmap_error:
+                    logging.warning(f"Memory-mapped index load failed ({mmap_error}); reading into memory.")
+                    self.index = faiss.read_index(self.index_file)
+                    self._index_read_only = False
+                if isinstance(self.index, faiss.IndexIVF):
+                    # nprobe is a runtime knob, not part of the serialized
+                    # index, so restore it after every load.
+                    self.index.nprobe = IVF_NPROBE
+                self.doc_chunks = self._load_doc_chunks()
+                # Shards written since the last compaction aren't in the
+                # base files yet; re-apply them before anything queries.
+                self._replay_shards()
+                self._load_train_buffer()
+                self.index = self._maybe_to_gpu(self.index)
                 logging.info(f"Loaded {self.index.ntotal} vectors and {len(self.doc_chunks)} document chunks.")
                 # Sanity check
                 if self.index.ntotal != len(self.doc_chunks):
@@ -69,6 +354,10 @@ class RAGProcessor:
             else:
                 logging.info("No existing vector store found. Initializing a new one.")
                 self._initialize_vector_store()
+                # The base files are only written at compaction time, so a
+                # young store may exist purely as shards; recover them.
+                self._replay_shards()
+                self._load_train_buffer()
         except Exception as e:
             logging.error(f"Error loading vector store from {self.vector_store_path}: {e}", exc_info=True)
             logging.info("Initializing a new vector store due to loading error.")
@@ -78,37 +367,507 @@ class RAGProcessor:
     def _initialize_vector_store(self):
         """Initializes an empty FAISS index."""
         logging.info(f"Creating a new FAISS index with dimension {self.embedding_dim}.")
-        # Using IndexFlatL2 - simple L2 distance search.
-        # For larger datasets, consider more advanced index types like IndexIVFFlat.
-        self.index = faiss.IndexFlatL2(self.embedding_dim)
+        self.index = self._maybe_to_gpu(self._new_index(0))
         self.doc_chunks = []
 
+    def _new_index(self, expected_size):
+        """
+        Builds the FAISS index best suited to a corpus of expected_size chunks.
+
+        Small corpora keep the exact IndexFlatL2 scan. Past HNSW_MIN_CHUNKS
+        an IndexHNSWFlat graph index is returned instead; it ingests vectors
+        through the same add() API and serializes transparently through
+        faiss.write_index. index_type='ivf-rq' overrides the size gate with
+        a compressed IVF index.
+
+        All variants use inner product over L2-normalized vectors (i.e.
+        cosine similarity) - the metric MiniLM embeddings are trained for,
+        and a single SGEMM per search instead of L2's subtract-square-sum.
+        """
+        if self.index_type == 'ivf-rq':
+            index = faiss.index_factory(self.embedding_dim, IVF_RQ_FACTORY,
+                                        faiss.METRIC_INNER_PRODUCT)
+            index.nprobe = IVF_NPROBE
+            return index
+        if expected_size > HNSW_MIN_CHUNKS:
+            index = faiss.IndexHNSWFlat(self.embedding_dim, HNSW_NEIGHBORS,
+                                        faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+            return index
+        return faiss.IndexFlatIP(self.embedding_dim)
+
+    def _maybe_to_gpu(self, index):
+        """
+        Moves an index to GPU 0 when a CUDA-enabled FAISS build and device
+        are available - the flat L2 scan is a distance matmul that GPUs run
+        5-20x faster. Returns the index unchanged on CPU-only builds
+        (faiss-cpu has no GPU symbols, so this is a cheap no-op there) or
+        when the transfer fails (e.g. HNSW has no GPU implementation).
+        """
+        if not hasattr(faiss, 'StandardGpuResources'):
+            return index
+        try:
+            num_gpus = faiss.get_num_gpus()
+            if num_gpus > 1:
+                # Shard across every GPU: each card holds and searches a
+                # slice of the vectors and FAISS k-way merges the local
+                # top-k transparently inside search(). Capacity and
+                # throughput both scale with GPU count, and corpora larger
+                # than one card's VRAM still fit.
+                cloner_options = faiss.GpuMultipleClonerOptions()
+                cloner_options.shard = True
+                gpu_index = faiss.index_cpu_to_all_gpus(index, co=cloner_options)
+                logging.info(f"FAISS index sharded across {num_gpus} GPUs.")
+            else:
+                if self._gpu_res is None:
+                    self._gpu_res = faiss.StandardGpuResources()
+                gpu_index = faiss.index_cpu_to_gpu(self._gpu_res, 0, index)
+                logging.info("FAISS index moved to GPU 0.")
+            self._on_gpu = True
+            self._index_read_only = False # The GPU copy owns its storage
+            return gpu_index
+        except Exception as e:
+            logging.warning(f"Could not move FAISS index to GPU, staying on CPU: {e}")
+            self._on_gpu = False
+            return index
+
+    def _ensure_writable_index(self):
+        """
+        Promotes a memory-mapped (read-only) index to an owning in-memory
+        copy before the first write. Queries run straight off the mmap; only
+        ingestion pays for the copy, and only once.
+        """
+        if not self._index_read_only:
+            return
+        with self._index_lock.write_locked():
+            if not self._index_read_only:
+                return # Another thread promoted while we waited
+            logging.info("Promoting memory-mapped index to a writable copy.")
+            self.index = faiss.clone_index(self.index)
+            self._index_read_only = False
+
+    def _locked_add(self, vectors):
+        """Adds vectors to the index under the exclusive write lock."""
+        with self._index_lock.write_locked():
+            self._ensure_writable_index()
+            self.index.add(vectors)
+
+    def _buffer_for_training(self, chunk_embeddings):
+        """
+        Accumulates embeddings for an untrained IVF index, training and
+        flushing the buffer once it holds enough samples. Buffered vectors
+        are not searchable (or persisted) until training completes.
+        """
+        self._train_buffer.append(chunk_embeddings)
+        buffered = sum(batch.shape[0] for batch in self._train_buffer)
+        needed = IVF_RQ_TRAIN_PER_LIST * IVF_RQ_NLIST
+        if buffered < needed:
+            # The buffered chunks are already in doc_chunks (and persisted
+            # with it), so their vectors must survive a restart too -
+            # otherwise training would later run without them and index ids
+            # would be permanently offset from chunk positions.
+            self._save_train_buffer()
+            logging.info(f"Buffered {buffered}/{needed} vectors for IVF training; index not yet searchable.")
+            return
+        try:
+            training_vectors = np.concatenate(self._train_buffer)
+            logging.info(f"Training IVF index on {training_vectors.shape[0]} vectors...")
+            with self._index_lock.write_locked():
+                self._ensure_writable_index()
+                self.index.train(training_vectors)
+                self.index.add(training_vectors)
+            self._train_buffer = []
+            self._remove_train_buffer_file()
+            logging.info(f"IVF index trained. Total vectors: {self.index.ntotal}")
+        except Exception as e:
+            logging.error(f"Failed to train IVF index: {e}", exc_info=True)
+
+    def _save_train_buffer(self):
+        """Mirrors the in-memory training buffer to disk."""
+        try:
+            np.save(self.train_buffer_file, np.concatenate(self._train_buffer))
+        except Exception as e:
+            logging.error(f"Failed to persist training buffer: {e}", exc_info=True)
+
+    def _remove_train_buffer_file(self):
+        """Deletes the on-disk training buffer once its vectors are indexed."""
+        try:
+            os.remove(self.train_buffer_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove training buffer file {self.train_buffer_file}: {e}")
+
+    def _load_train_buffer(self):
+        """
+        Restores buffered training vectors written by _save_train_buffer.
+
+        Without this, a restart before training would keep the buffered
+        chunks (they were saved with doc_chunks) but drop their embeddings,
+        and every vector added after training would map to the wrong chunk.
+        """
+        if self.index.is_trained or not os.path.exists(self.train_buffer_file):
+            return
+        try:
+            buffered = np.load(self.train_buffer_file)
+            self._train_buffer = [buffered]
+            logging.info(f"Restored {buffered.shape[0]} buffered training vectors from disk.")
+        except Exception as e:
+            logging.error(f"Failed to restore training buffer: {e}", exc_info=True)
+
+    def _maybe_upgrade_index(self):
+        """
+        Migrates the index to HNSW (the top tier) once the corpus outgrows
+        the flat/IVFFlat tiers.
+
+        Stored vectors are reconstructed in one call and re-added to the
+        new graph index, so retrieval keeps working unchanged afterwards.
+        Most stores arrive here as IVFFlat (the mid tier rebuilt at save
+        time past IVFFLAT_MIN_CHUNKS); a flat index that grew past the
+        HNSW cutoff between saves is migrated directly.
+        """
+        if self.index_type == 'ivf-rq':
+            return # Compressed stores keep their IVF-RQ layout
+        if not isinstance(self.index, (faiss.IndexFlat, faiss.IndexIVFFlat)):
+            return # Already HNSW (or something we shouldn't rebuild)
+        if self.index.ntotal <= HNSW_MIN_CHUNKS:
+            return
+        logging.info(f"Corpus reached {self.index.ntotal} chunks; migrating index to HNSW.")
+        try:
+            # Exclusive for the whole migration: a concurrent add between
+            # reconstruct and the swap would be silently dropped.
+            with self._index_lock.write_locked():
+                if isinstance(self.index, faiss.IndexIVFFlat):
+                    # IVF reconstruction needs the id -> list position map.
+                    self.index.make_direct_map()
+                vectors = self.index.reconstruct_n(0, self.index.ntotal)
+                # Keep the existing metric: legacy stores are L2 over
+                # unnormalized vectors, and re-adding those into an IP index
+                # (what _new_index builds) would rank results by vector norm.
+                upgraded = faiss.IndexHNSWFlat(self.embedding_dim, HNSW_NEIGHBORS,
+                                               self.index.metric_type)
+                upgraded.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+                upgraded.hnsw.efSearch = HNSW_EF_SEARCH
+                upgraded.add(vectors)
+                self.index = upgraded
+            logging.info("HNSW migration complete.")
+        except Exception as e:
+            logging.error(f"Failed to migrate index to HNSW: {e}", exc_info=True)
+
+
+    def _load_doc_chunks(self):
+        """
+        Loads the chunk list from disk, preferring the columnar Arrow file.
+
+        Arrow decodes the two columns in bulk (and keeps duplicate source
+        names dictionary-encoded on disk) instead of pickle's per-object
+        reconstruction. Stores written before the Arrow switch are still
+        read through the legacy pickle path and converted on the next save.
+        """
+        if os.path.exists(self.doc_chunks_file):
+            logging.info(f"Loading document chunks from {self.doc_chunks_file}")
+            return self._read_chunks_arrow(self.doc_chunks_file)
+        logging.info(f"Loading document chunks from legacy pickle {self.legacy_chunks_file}")
+        with open(self.legacy_chunks_file, 'rb') as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def _read_chunks_arrow(path):
+        """Reads a chunk list from a columnar Arrow IPC file."""
+        with pa.memory_map(path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        texts = table.column('text').to_pylist()
+        sources = table.column('source').to_pylist()
+        return [{'text': text, 'source': src} for text, src in zip(texts, sources)]
+
+    @staticmethod
+    def _write_chunks_arrow(chunks, path):
+        """Writes a chunk list as a columnar Arrow IPC file."""
+        table = pa.table({
+            'text': pa.array([chunk['text'] for chunk in chunks]),
+            # Dictionary encoding stores each distinct filename once.
+            'source': pa.array([chunk['source'] for chunk in chunks]).dictionary_encode(),
+        })
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def _save_doc_chunks(self):
+        """Writes the full chunk list as a columnar Arrow IPC file."""
+        logging.info(f"Saving document chunks to {self.doc_chunks_file}")
+        self._write_chunks_arrow(self.doc_chunks, self.doc_chunks_file)
+
+    def _maybe_upgrade_to_ivfflat(self):
+        """
+        One-time rebuild of the index as IVFFlat once the corpus passes
+        IVFFLAT_MIN_CHUNKS vectors.
+
+        IVFFlat keeps exact vectors but clusters them (nlist ~ sqrt(N)),
+        so each query scans only nprobe = nlist/10 clusters instead of the
+        whole corpus. This is the middle tier of flat -> IVFFlat -> HNSW:
+        only flat indexes are rebuilt, so an index that already graduated
+        to HNSW (past HNSW_MIN_CHUNKS) is never torn back down - that
+        would discard the graph the corpus just paid to build. Also
+        skipped for 'ivf-rq' stores (already IVF) and GPU indexes (flat
+        search is already fast there).
+        """
+        if self.index_type == 'ivf-rq' or self._on_gpu:
+            return
+        if not isinstance(self.index, faiss.IndexFlat):
+            return # Already IVFFlat or HNSW; those tiers only move up
+        num_vectors = self.index.ntotal
+        if num_vectors <= IVFFLAT_MIN_CHUNKS:
+            return
+        logging.info(f"Corpus reached {num_vectors} chunks; rebuilding index as IVFFlat.")
+        try:
+            with self._index_lock.write_locked():
+                vectors = self.index.reconstruct_n(0, num_vectors)
+                nlist = max(1, int(num_vectors ** 0.5))
+                metric = self.index.metric_type
+                if metric == faiss.METRIC_INNER_PRODUCT:
+                    quantizer = faiss.IndexFlatIP(self.embedding_dim)
+                else:
+                    quantizer = faiss.IndexFlatL2(self.embedding_dim)
+                ivf = faiss.IndexIVFFlat(quantizer, self.embedding_dim, nlist, metric)
+                ivf.train(vectors)
+                ivf.add(vectors)
+                ivf.nprobe = max(1, nlist // 10)
+                self.index = ivf
+                self._index_read_only = False
+            logging.info(f"IVFFlat rebuild complete (nlist={nlist}, nprobe={ivf.nprobe}).")
+        except Exception as e:
+            logging.error(f"Failed to rebuild index as IVFFlat: {e}", exc_info=True)
 
     def _save_vector_store(self):
-        """Saves the FAISS index and document chunks to disk."""
+        """Saves the full FAISS index and document chunk list to disk."""
         try:
+            # Re-index mid-size corpora at most once, out of the hot path.
+            self._maybe_upgrade_to_ivfflat()
             logging.info(f"Saving FAISS index to {self.index_file}")
-            faiss.write_index(self.index, self.index_file)
-            logging.info(f"Saving document chunks to {self.doc_chunks_file}")
-            with open(self.doc_chunks_file, 'wb') as f:
-                pickle.dump(self.doc_chunks, f)
+            # GPU indexes can't be serialized directly; copy back to host first.
+            index_to_write = faiss.index_gpu_to_cpu(self.index) if self._on_gpu else self.index
+            faiss.write_index(index_to_write, self.index_file)
+            self._save_doc_chunks()
+            # Refreshed on full saves only; incremental shard saves skip it
+            # and the next compaction catches the cache up.
+            self._save_token_cache()
+            self._store_files_mtime = self._store_mtime()
             logging.info("Vector store saved successfully.")
         except Exception as e:
             logging.error(f"Error saving vector store to {self.vector_store_path}: {e}", exc_info=True)
 
+    def _save_token_cache(self):
+        """
+        Caches every chunk's token ids as an int32 [N, max_len] array on disk.
+
+        With this in place, rebuild_index_from_token_cache() can regenerate
+        all embeddings with nothing but model forward passes.
+        """
+        tokenizer = getattr(self.embedding_model, 'tokenizer', None)
+        if tokenizer is None or not self.doc_chunks:
+            return
+        try:
+            encoded = tokenizer([chunk['text'] for chunk in self.doc_chunks],
+                                padding='max_length', truncation=True,
+                                max_length=TOKEN_CACHE_MAX_LEN, return_tensors='np')
+            np.save(self.token_ids_file, encoded['input_ids'].astype('int32'))
+            logging.info(f"Cached token ids for {len(self.doc_chunks)} chunks to {self.token_ids_file}")
+        except Exception as e:
+            logging.error(f"Failed to cache token ids: {e}", exc_info=True)
+
+    def rebuild_index_from_token_cache(self, batch_size=256):
+        """
+        Rebuilds every embedding (and a fresh index) from the cached token
+        ids - useful after switching to another embedding model that shares
+        the tokenizer vocabulary. Extraction, chunking and tokenization are
+        all skipped; only the forward pass runs, streamed off a memmap of
+        the cache so the whole id matrix never sits in RAM.
+
+        Returns:
+            bool: True if the index was rebuilt, False otherwise.
+        """
+        # The token cache is only refreshed on full saves, so outstanding
+        # shards mean it lags doc_chunks - and the full save below would
+        # leave those shards on disk to be replayed on top of a base store
+        # that already contains them. Compact first: that folds the shards
+        # in, rewrites the token cache to match, and removes the shard
+        # files, leaving a consistent snapshot to rebuild from.
+        if self._shard_numbers():
+            self._compact_shards()
+        if not os.path.exists(self.token_ids_file):
+            logging.warning("No token cache found; cannot rebuild from cache.")
+            return False
+        try:
+            token_ids = np.load(self.token_ids_file, mmap_mode='r')
+            pad_id = self.embedding_model.tokenizer.pad_token_id or 0
+            batches = []
+            for start in range(0, token_ids.shape[0], batch_size):
+                input_ids = torch.from_numpy(np.asarray(token_ids[start:start + batch_size]).astype('int64'))
+                # The mask is implied by the fixed-length padding, so it
+                # doesn't need to be stored alongside the ids.
+                attention_mask = (input_ids != pad_id).long()
+                features = {
+                    'input_ids': input_ids.to(self.embedding_model.device),
+                    'attention_mask': attention_mask.to(self.embedding_model.device),
+                }
+                with torch.no_grad():
+                    output = self.embedding_model(features)
+                batches.append(output['sentence_embedding'].cpu().numpy())
+            vectors = np.concatenate(batches).astype('float32', copy=False)
+
+            index = self._new_index(vectors.shape[0])
+            if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+                faiss.normalize_L2(vectors)
+            if not index.is_trained:
+                index.train(vectors)
+            index.add(vectors)
+            with self._index_lock.write_locked():
+                self._index_read_only = False
+                self.index = self._maybe_to_gpu(index)
+            self._save_vector_store()
+            logging.info(f"Rebuilt index from token cache ({vectors.shape[0]} vectors).")
+            return True
+        except Exception as e:
+            logging.error(f"Failed to rebuild index from token cache: {e}", exc_info=True)
+            return False
+
+    def _shard_paths(self, k):
+        """Returns the (chunks, vectors) file paths for shard number k."""
+        return (os.path.join(self.vector_store_path, f'chunks_{k}.arrow'),
+                os.path.join(self.vector_store_path, f'vectors_{k}.npy'))
+
+    def _shard_numbers(self):
+        """Returns the sorted shard numbers currently on disk."""
+        numbers = []
+        try:
+            for name in os.listdir(self.vector_store_path):
+                if name.startswith('chunks_') and name.endswith('.arrow'):
+                    try:
+                        numbers.append(int(name[len('chunks_'):-len('.arrow')]))
+                    except ValueError:
+                        continue # Not one of ours
+        except FileNotFoundError:
+            pass
+        return sorted(numbers)
+
+    def _save_shard(self, new_chunks, new_embeddings):
+        """
+        Persists one document's chunks and vectors as an append-only shard.
+
+        Writing only the new data keeps each save O(document) instead of
+        O(corpus); once SHARD_COMPACT_THRESHOLD shards accumulate they are
+        folded into the base index/chunk files and deleted.
+        """
+        try:
+            shard_numbers = self._shard_numbers()
+            k = shard_numbers[-1] + 1 if shard_numbers else 0
+            chunks_path, vectors_path = self._shard_paths(k)
+            np.save(vectors_path, new_embeddings)
+            self._write_chunks_arrow(new_chunks, chunks_path)
+            logging.info(f"Saved shard {k} ({len(new_chunks)} chunks).")
+            self._store_files_mtime = self._store_mtime()
+            if len(shard_numbers) + 1 >= SHARD_COMPACT_THRESHOLD:
+                self._compact_shards()
+        except Exception as e:
+            logging.error(f"Error saving shard to {self.vector_store_path}: {e}", exc_info=True)
+
+    def _compact_shards(self):
+        """Folds all shards into the base store files and removes them."""
+        logging.info(f"Compacting {len(self._shard_numbers())} shards into the base store...")
+        self._save_vector_store()
+        for k in self._shard_numbers():
+            for path in self._shard_paths(k):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.warning(f"Could not remove shard file {path}: {e}")
+        logging.info("Shard compaction complete.")
+
+    def _replay_shards(self):
+        """
+        Re-applies on-disk shards that postdate the base store files.
+
+        Shards hold raw embeddings, so replaying them is a straight
+        index.add per shard - no re-encoding.
+        """
+        for k in self._shard_numbers():
+            chunks_path, vectors_path = self._shard_paths(k)
+            try:
+                vectors = np.load(vectors_path)
+                self._locked_add(vectors.astype('float32', copy=False))
+                self.doc_chunks.extend(self._read_chunks_arrow(chunks_path))
+                logging.info(f"Replayed shard {k} ({vectors.shape[0]} vectors).")
+            except Exception as e:
+                logging.error(f"Failed to replay shard {k}: {e}", exc_info=True)
+
+    def _store_mtime(self):
+        """Returns the newest mtime across the base store and shard files."""
+        latest = 0.0
+        paths = [self.index_file, self.doc_chunks_file, self.legacy_chunks_file]
+        for k in self._shard_numbers():
+            paths.extend(self._shard_paths(k))
+        for path in paths:
+            try:
+                latest = max(latest, os.path.getmtime(path))
+            except OSError:
+                continue # File absent (e.g. no legacy pickle)
+        return latest
+
+    def refresh_if_stale(self):
+        """
+        Reloads the store from disk when another process has written to it.
+
+        Under `gunicorn -w N`, an upload only updates the handling worker's
+        in-memory index; the others would keep answering from the old corpus
+        indefinitely. The query path calls this before searching - the check
+        is a stat sweep of the store directory, so a no-change call is cheap.
+
+        Returns:
+            bool: True if the store was reloaded (callers should then drop
+            any answer caches keyed on the old corpus), False otherwise.
+        """
+        latest = self._store_mtime()
+        if latest <= self._store_files_mtime:
+            return False
+        logging.info("Vector store changed on disk (another worker?); reloading.")
+        # Ingest mutex first (same order as the ingest paths): reloading
+        # mid-ingest would discard vectors the ingest already added while
+        # it still intends to extend doc_chunks for them.
+        with self._ingest_lock, self._index_lock.write_locked():
+            self._train_buffer = []
+            self._on_gpu = False
+            self._index_read_only = False
+            self._load_vector_store()
+            self._chunk_hashes = {_chunk_digest(chunk['text']) for chunk in self.doc_chunks}
+            self._store_files_mtime = self._store_mtime()
+        return True
+
 
     def _extract_text_from_pdf(self, file_path):
-        """Extracts text from a PDF file."""
+        """Extracts text from a PDF file (accepts a path or an open binary stream)."""
         logging.info(f"Extracting text from PDF: {file_path}")
-        text = ""
         try:
             reader = PdfReader(file_path)
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n" # Add newline between pages
-            logging.info(f"Successfully extracted text from {len(reader.pages)} pages in {file_path}")
-            return text
+            num_pages = len(reader.pages)
+            # A missing /Contents stream means the page can't have any
+            # text; checking it is a dict lookup, vs. extract_text()
+            # running the full layout parser to find nothing. Filtering
+            # here keeps both branches below byte-identical in output.
+            page_indices = [i for i, page in enumerate(reader.pages)
+                            if page.get("/Contents") is not None]
+            # Page parsing is CPU-bound and independent across pages, so
+            # large on-disk files are farmed out to a process pool for a
+            # near-linear speedup in core count. Streams can't be re-opened
+            # by workers and keep the sequential path.
+            if isinstance(file_path, (str, os.PathLike)) and len(page_indices) >= PDF_PARALLEL_MIN_PAGES:
+                with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+                    texts = list(pool.map(partial(_pdf_page_text, file_path),
+                                          page_indices, chunksize=10))
+            else:
+                texts = [reader.pages[i].extract_text() or "" for i in page_indices]
+            logging.info(f"Successfully extracted text from {num_pages} pages in {file_path}")
+            return "\n".join(texts) # Newline between pages
         except Exception as e:
             logging.error(f"Failed to extract text from PDF {file_path}: {e}", exc_info=True)
             return "" # Return empty string on failure
@@ -125,27 +884,59 @@ class RAGProcessor:
             logging.error(f"Failed to read text file {file_path}: {e}", exc_info=True)
             return "" # Return empty string on failure
 
-    def _split_text_into_chunks(self, text, chunk_size=500, chunk_overlap=50):
+    @staticmethod
+    def _split_text_into_chunks(text, chunk_size=500, chunk_overlap=50):
         """
         Splits text into overlapping chunks.
         A simple implementation, more sophisticated methods exist (e.g., LangChain's splitters).
+        Static so process-pool ingest workers can call it without an instance.
         """
         # Basic splitting by characters - consider splitting by paragraphs or sentences
         # for potentially better semantic coherence within chunks.
         if not text:
             return []
 
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + chunk_size
-            chunks.append(text[start:end])
-            start += chunk_size - chunk_overlap # Move start forward, considering overlap
-            if start < 0: # Prevent infinite loop if overlap >= size
-                 start = end
+        step = chunk_size - chunk_overlap
+        if step <= 0:
+            # Validated once up front instead of guarding every iteration.
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size}).")
+
+        # All start offsets come from one range object, so the whole split
+        # is a single list comprehension of slices - no per-iteration
+        # bookkeeping in the interpreter loop.
+        chunks = [text[start:start + chunk_size] for start in range(0, len(text), step)]
         logging.info(f"Split text into {len(chunks)} chunks (size={chunk_size}, overlap={chunk_overlap}).")
         return chunks
 
+    def _split_text_into_token_chunks(self, text, chunk_tokens=256, chunk_overlap=32):
+        """
+        Splits text into overlapping chunks by token budget.
+
+        Character counts map to wildly varying token counts, so fixed-char
+        chunks either get truncated by the encoder (losing information) or
+        embed mostly padding. Splitting on the tokenizer's own ids makes
+        every chunk fit the model's context exactly. Falls back to the
+        character-based splitter when no local tokenizer is available.
+        """
+        if not text:
+            return []
+        tokenizer = getattr(self.embedding_model, 'tokenizer', None)
+        if tokenizer is None:
+            return self._split_text_into_chunks(text)
+
+        step = chunk_tokens - chunk_overlap
+        if step <= 0:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_tokens ({chunk_tokens}).")
+        try:
+            token_ids = tokenizer(text, add_special_tokens=False)['input_ids']
+            chunks = [tokenizer.decode(token_ids[start:start + chunk_tokens])
+                      for start in range(0, len(token_ids), step)]
+            logging.info(f"Split text into {len(chunks)} chunks (tokens={chunk_tokens}, overlap={chunk_overlap}).")
+            return chunks
+        except Exception as e:
+            logging.error(f"Token-aware chunking failed ({e}); falling back to character chunks.")
+            return self._split_text_into_chunks(text)
+
 
     def add_document(self, file_path):
         """
@@ -163,39 +954,240 @@ class RAGProcessor:
             logging.warning(f"Unsupported file type skipped: {filename}")
             return # Or raise an error
 
+        self._index_text(text, filename)
+
+    def add_documents(self, file_paths):
+        """
+        Ingests a batch of documents at once.
+
+        Extraction and chunking fan out to a process pool (CPU-bound and
+        independent per file), then every chunk is embedded in one batched
+        encode and added to the index with a single add and a single save -
+        instead of paying the full extract/encode/save cycle per file.
+
+        Args:
+            file_paths (list[str]): Paths of the documents to ingest.
+        """
+        file_paths = list(file_paths)
+        if not file_paths:
+            return
+        logging.info(f"Bulk-ingesting {len(file_paths)} documents...")
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+            results = list(pool.map(_extract_and_chunk, file_paths))
+
+        # Same single-ingest mutex as _index_text: dedupe, add, extend and
+        # shard save must not interleave with another ingest. Extraction
+        # above stays outside the mutex - it touches no shared state.
+        with self._ingest_lock:
+            all_chunks = [] # Flat chunk texts, for one batched encode
+            new_chunks = [] # Parallel {'text', 'source'} records
+            pending_digests = set()
+            for chunks, filename in results:
+                if not chunks:
+                    logging.warning(f"No chunks generated for {filename}. Skipping.")
+                    continue
+                chunks, digests = self._filter_duplicate_chunks(chunks, filename,
+                                                                also_pending=pending_digests)
+                pending_digests.update(digests)
+                all_chunks.extend(chunks)
+                new_chunks.extend({'text': chunk, 'source': filename} for chunk in chunks)
+            if not all_chunks:
+                logging.warning("Bulk ingest produced no new chunks. Nothing to add.")
+                return
+
+            logging.info(f"Generating embeddings for {len(all_chunks)} chunks from {len(file_paths)} documents...")
+            try:
+                embeddings = self.embedding_model.encode(all_chunks, batch_size=256, show_progress_bar=True)
+                embeddings = np.asarray(embeddings).astype('float32', copy=False)
+                if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+                    faiss.normalize_L2(embeddings)
+            except Exception as e:
+                logging.error(f"Failed to generate embeddings for bulk ingest: {e}", exc_info=True)
+                return
+
+            if self.index.is_trained:
+                # Mirror _index_text: index add first, chunks and digests
+                # committed only once the vectors are actually in. A failed
+                # add would otherwise leave doc_chunks ahead of the index
+                # (misaligned ids) with the digests blocking a re-ingest.
+                try:
+                    self._locked_add(embeddings)
+                except Exception as e:
+                    logging.error(f"Failed to add bulk-ingest vectors to the index: {e}", exc_info=True)
+                    return
+                self.doc_chunks.extend(new_chunks)
+                self._chunk_hashes.update(pending_digests)
+                self._maybe_upgrade_index()
+                self._save_shard(new_chunks, embeddings)
+            else:
+                # Buffered vectors persist with the chunk list (chunk2-2),
+                # so extending before buffering is safe here.
+                self.doc_chunks.extend(new_chunks)
+                self._chunk_hashes.update(pending_digests)
+                self._buffer_for_training(embeddings)
+                self._save_vector_store()
+            logging.info(f"Bulk ingest complete. Total vectors: {self.index.ntotal}")
+
+    def _filter_duplicate_chunks(self, chunks, filename, also_pending=None):
+        """
+        Splits a chunk list into (unique_chunks, their_digests), dropping
+        any whose text is already indexed or already queued in this batch.
+
+        Args:
+            chunks (list[str]): Candidate chunk texts.
+            filename (str): Source name, for logging.
+            also_pending (set, optional): Digests accepted earlier in the
+                same batch (bulk ingest) that aren't in _chunk_hashes yet.
+        """
+        unique_chunks = []
+        digests = set()
+        for chunk in chunks:
+            digest = _chunk_digest(chunk)
+            if digest in self._chunk_hashes or digest in digests:
+                continue
+            if also_pending is not None and digest in also_pending:
+                continue
+            digests.add(digest)
+            unique_chunks.append(chunk)
+        skipped = len(chunks) - len(unique_chunks)
+        if skipped:
+            logging.info(f"Skipped {skipped} duplicate chunks from {filename}.")
+        return unique_chunks, digests
+
+    def _index_text(self, text, filename):
+        """
+        Shared ingestion tail: splits extracted text into chunks, embeds
+        them, and adds them to the vector store.
+        """
         if not text:
             logging.warning(f"No text extracted from {filename}. Skipping.")
             return
 
-        # Split text into manageable chunks
-        chunks = self._split_text_into_chunks(text)
+        # Split text into manageable chunks, sized by token budget
+        chunks = self._split_text_into_token_chunks(text)
         if not chunks:
             logging.warning(f"No chunks generated for {filename}. Skipping.")
             return
 
-        # Generate embeddings for the chunks
-        logging.info(f"Generating embeddings for {len(chunks)} chunks from {filename}...")
+        # One document mutates the store at a time: without this mutex,
+        # two overlapping ingests on a threaded worker interleave their
+        # mini-batch index adds while each doc_chunks.extend lands later
+        # in completion order - permanently misaligning vector ids with
+        # chunk texts - and both race to write the same shard number.
+        # The readers-writer lock only makes each individual add atomic.
+        with self._ingest_lock:
+            # Drop chunks whose exact text is already indexed - they would
+            # embed to the same vector and only dilute retrieval. The digests
+            # join _chunk_hashes after a successful add, so a failed ingest
+            # doesn't block re-ingesting the same document.
+            chunks, pending_digests = self._filter_duplicate_chunks(chunks, filename)
+            if not chunks:
+                logging.info(f"All chunks from {filename} are already indexed. Skipping.")
+                return
+
+            logging.info(f"Generating embeddings for {len(chunks)} chunks from {filename}...")
+            new_chunks = [{'text': chunk, 'source': filename} for chunk in chunks]
+
+            if self.index.is_trained:
+                # Pipelined path: encode batch k+1 while batch k is added to
+                # the index on a worker thread.
+                chunk_embeddings = self._encode_and_add_pipelined(chunks)
+                if chunk_embeddings is None:
+                    logging.warning(f"No embeddings were generated or added for {filename}.")
+                    return
+                # A mid-ingest failure leaves only a prefix of the chunks in
+                # the index; extend/persist exactly that prefix so ids and
+                # chunk positions stay aligned. The dropped tail re-ingests
+                # cleanly later (its digests never join _chunk_hashes).
+                added_chunks = new_chunks[:chunk_embeddings.shape[0]]
+                if len(added_chunks) < len(new_chunks):
+                    logging.warning(f"Indexed only {len(added_chunks)}/{len(new_chunks)} "
+                                    f"chunks from {filename}; re-upload to ingest the rest.")
+                self.doc_chunks.extend(added_chunks)
+                self._chunk_hashes.update(_chunk_digest(chunk['text']) for chunk in added_chunks)
+                # Switch to a graph index if the corpus has outgrown flat search
+                self._maybe_upgrade_index()
+                # Persist only this document's data; compaction folds shards
+                # into the base store periodically.
+                self._save_shard(added_chunks, chunk_embeddings)
+            else:
+                # IVF indexes can't ingest before training; encode everything
+                # up front and buffer until enough samples have accumulated.
+                chunk_embeddings = self._encode_chunks(chunks)
+                if chunk_embeddings is None:
+                    logging.warning(f"No embeddings were generated or added for {filename}.")
+                    return
+                self.doc_chunks.extend(new_chunks)
+                self._chunk_hashes.update(pending_digests)
+                self._buffer_for_training(chunk_embeddings)
+                self._save_vector_store()
+
+    def _encode_chunks(self, chunks):
+        """
+        Embeds a list of chunk texts, returning a float32 array normalized
+        to match the index metric, or None on failure.
+
+        encode() already sorts inputs by length internally, so each batch
+        pads only to its own longest member; batch_size=64 (over the
+        default 32) amortizes per-batch overhead further for short chunks.
+        """
         try:
-            chunk_embeddings = self.embedding_model.encode(chunks, show_progress_bar=True)
-            # Ensure embeddings are float32, FAISS requirement
-            chunk_embeddings = np.array(chunk_embeddings).astype('float32')
-            logging.info(f"Generated {chunk_embeddings.shape[0]} embeddings.")
+            embeddings = self.embedding_model.encode(chunks, batch_size=64, show_progress_bar=True)
+            # Ensure embeddings are float32 (FAISS requirement); copy=False
+            # makes this free when the model already emits fp32.
+            embeddings = np.asarray(embeddings).astype('float32', copy=False)
+            if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+                # Cosine space: normalize once at ingest; legacy L2 stores
+                # loaded from disk skip this and keep their original metric.
+                faiss.normalize_L2(embeddings)
+            return embeddings if embeddings.shape[0] > 0 else None
         except Exception as e:
-            logging.error(f"Failed to generate embeddings for {filename}: {e}", exc_info=True)
-            return # Skip adding this document if embedding fails
-
-        # Add embeddings to FAISS index
-        if chunk_embeddings.shape[0] > 0:
-            self.index.add(chunk_embeddings)
-            # Store the corresponding text chunks and their source
-            for i, chunk in enumerate(chunks):
-                self.doc_chunks.append({'text': chunk, 'source': filename})
-            logging.info(f"Added {chunk_embeddings.shape[0]} vectors to FAISS index. Total vectors: {self.index.ntotal}")
-
-            # Save the updated index and chunks
-            self._save_vector_store()
-        else:
-            logging.warning(f"No embeddings were generated or added for {filename}.")
+            logging.error(f"Failed to generate embeddings: {e}", exc_info=True)
+            return None
+
+    def _encode_and_add_pipelined(self, chunks):
+        """
+        Encodes chunks in mini-batches and adds each to the index while the
+        next batch is being encoded, hiding the CPU-side FAISS add (and its
+        memory traffic) under the encoder's compute.
+
+        At most one add is in flight at a time, so memory stays bounded.
+
+        A failed encode or add aborts the loop instead of skipping: adding
+        anything after a gap would land every later vector at the wrong
+        position relative to doc_chunks. Returns the stacked embeddings of
+        the batches confirmed in the index - possibly a prefix of the
+        input, and the caller must align doc_chunks to exactly that many
+        chunks - or None if nothing was added.
+        """
+        self._ensure_writable_index()
+        added = [] # Batches whose index add has completed
+        try:
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-ingest") as adder:
+                pending = None
+                pending_batch = None
+                for start in range(0, len(chunks), INGEST_ENCODE_BATCH):
+                    batch_embeddings = self._encode_chunks(chunks[start:start + INGEST_ENCODE_BATCH])
+                    if batch_embeddings is None:
+                        logging.error("Encoding failed mid-ingest; stopping at the prefix already indexed.")
+                        break
+                    if pending is not None:
+                        pending.result() # Previous add must finish first
+                        added.append(pending_batch)
+                    pending = adder.submit(self._locked_add, batch_embeddings)
+                    pending_batch = batch_embeddings
+                if pending is not None:
+                    pending.result()
+                    added.append(pending_batch)
+        except Exception as e:
+            prefix = sum(batch.shape[0] for batch in added)
+            logging.error(f"Pipelined encode/add failed; keeping the {prefix}-vector "
+                          f"prefix already in the index: {e}", exc_info=True)
+        if not added:
+            return None
+        stacked = np.concatenate(added) if len(added) > 1 else added[0]
+        logging.info(f"Added {stacked.shape[0]} vectors to FAISS index. Total vectors: {self.index.ntotal}")
+        return stacked
 
 
     def retrieve_relevant_chunks(self, query, k=5):
@@ -207,37 +1199,15 @@ class RAGProcessor:
 
         logging.info(f"Embedding query: '{query}'")
         try:
-            query_embedding = self.embedding_model.encode([query])
-            query_embedding = np.array(query_embedding).astype('float32')
+            query_embedding = self._embed_query(query)
             logging.info("Query embedded successfully.")
         except Exception as e:
             logging.error(f"Failed to embed query '{query}': {e}", exc_info=True)
             return [] # Return empty list if embedding fails
 
-        if self.index is None or self.index.ntotal == 0:
-            logging.warning("Vector store is empty or not initialized. Cannot retrieve chunks.")
-            return []
-
         # Search the FAISS index
         logging.info(f"Searching index for {k} nearest neighbors...")
-        try:
-            # D: distances, I: indices of neighbors
-            distances, indices = self.index.search(query_embedding, k)
-            logging.info(f"Search complete. Found indices: {indices}")
-
-            # Retrieve the actual text chunks using the indices
-            # indices[0] because we searched for a single query vector
-            relevant_chunks = [self.doc_chunks[i] for i in indices[0] if 0 <= i < len(self.doc_chunks)]
-
-            # Optional: Filter by distance threshold if needed
-            # threshold = 1.0 # Example threshold for L2 distance (lower is better)
-            # relevant_chunks = [self.doc_chunks[indices[0][j]] for j, dist in enumerate(distances[0]) if dist < threshold and 0 <= indices[0][j] < len(self.doc_chunks)]
-
-            logging.info(f"Retrieved {len(relevant_chunks)} relevant chunks.")
-            return relevant_chunks
-        except Exception as e:
-            logging.error(f"Error during FAISS search for query '{query}': {e}", exc_info=True)
-            return []
+        return self._search_embedding(query_embedding, k)
 
 
     def answer_query(self, query):
@@ -251,7 +1221,127 @@ class RAGProcessor:
 
         # 1. Retrieve relevant context
         relevant_chunks = self.retrieve_relevant_chunks(query, k=5) # Get top 5 chunks
+        return self._generate_answer(query, relevant_chunks)
+
+    @lru_cache(maxsize=1024)
+    def _embed_query_bytes(self, query):
+        """
+        Embeds a single query and caches the result as bytes.
 
+        Chat sessions repeat queries often (retries, identical follow-ups),
+        and each repeat would otherwise pay a full transformer forward
+        pass. Bytes rather than the ndarray itself: callers (e.g.
+        faiss.normalize_L2) mutate arrays in place, and a mutated cache
+        entry would poison every later hit.
+        """
+        embedding = self.embedding_model.encode([query])
+        return np.asarray(embedding).astype('float32', copy=False).tobytes()
+
+    def _embed_query(self, query):
+        """Returns a writable (1, dim) float32 embedding for a query, cached by text."""
+        data = self._embed_query_bytes(query)
+        return np.frombuffer(data, dtype='float32').reshape(1, -1).copy()
+
+    def embed_queries(self, queries):
+        """
+        Embeds a list of queries in a single forward pass.
+
+        Returns:
+            np.ndarray: Float32 array of shape (len(queries), embedding_dim),
+            or None if embedding fails.
+        """
+        logging.info(f"Embedding batch of {len(queries)} queries...")
+        try:
+            query_embeddings = self.embedding_model.encode(queries)
+            return np.asarray(query_embeddings).astype('float32', copy=False)
+        except Exception as e:
+            logging.error(f"Failed to embed query batch: {e}", exc_info=True)
+            return None
+
+    def answer_queries_batch(self, queries, k=5, query_embeddings=None):
+        """
+        Answers several queries at once, sharing a single embedding forward pass.
+
+        Encoding queries one at a time on CPU wastes the batching speedup the
+        sentence-transformer provides; encoding them together amortizes
+        tokenization and model overhead across the batch. Retrieval and the
+        OpenAI call still happen per query.
+
+        Args:
+            queries (list[str]): The query texts.
+            k (int): Number of chunks to retrieve per query.
+            query_embeddings (np.ndarray, optional): Precomputed embeddings
+                for the queries (e.g. from embed_queries, so callers doing a
+                semantic cache lookup don't pay for encoding twice).
+
+        Returns:
+            list[str]: One answer per query, in the same order.
+        """
+        if not queries:
+            return []
+
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(queries)
+        if query_embeddings is None:
+            return [ERROR_ANSWER] * len(queries)
+
+        # One FAISS call for the whole batch: the SIMD distance kernels
+        # process all query vectors together, scaling sublinearly with
+        # batch size compared to per-query searches.
+        chunk_lists = self._search_embeddings_batch(query_embeddings, k)
+
+        if len(queries) == 1:
+            return [self._generate_answer(queries[0], chunk_lists[0])]
+
+        # The per-query OpenAI calls are independent and I/O-bound, so
+        # overlap them instead of waiting on each in turn.
+        with ThreadPoolExecutor(max_workers=min(8, len(queries)), thread_name_prefix="rag-llm") as pool:
+            return list(pool.map(self._generate_answer, queries, chunk_lists))
+
+    def _search_embedding(self, query_embedding, k):
+        """
+        Searches the FAISS index with an already-computed query embedding
+        (shape (1, dim), float32) and returns the matching document chunks.
+        """
+        return self._search_embeddings_batch(query_embedding, k)[0]
+
+    def _search_embeddings_batch(self, query_embeddings, k):
+        """
+        Searches the FAISS index with a batch of query embeddings
+        (shape (nq, dim), float32) in a single call.
+
+        Returns:
+            list[list[dict]]: One chunk list per query, in order.
+        """
+        num_queries = query_embeddings.shape[0]
+        if self.index is None or self.index.ntotal == 0:
+            logging.warning("Vector store is empty or not initialized. Cannot retrieve chunks.")
+            return [[] for _ in range(num_queries)]
+
+        try:
+            if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+                # Match the ingest-side normalization (copy first:
+                # normalize_L2 works in place and callers may reuse the
+                # embeddings, e.g. for the semantic cache).
+                query_embeddings = query_embeddings.copy()
+                faiss.normalize_L2(query_embeddings)
+            # Shared lock: searches run concurrently with each other but
+            # never overlap index mutation (FAISS forbids add/search races).
+            with self._index_lock.read_locked():
+                # D: distances, I: indices of neighbors (one row per query)
+                distances, indices = self.index.search(query_embeddings, k)
+            chunk_lists = [
+                [self.doc_chunks[i] for i in row if 0 <= i < len(self.doc_chunks)]
+                for row in indices
+            ]
+            logging.info(f"Retrieved chunks for {num_queries} queries in one search.")
+            return chunk_lists
+        except Exception as e:
+            logging.error(f"Error during FAISS search: {e}", exc_info=True)
+            return [[] for _ in range(num_queries)]
+
+    def _build_prompt(self, query, relevant_chunks):
+        """Builds the RAG prompt string from the query and retrieved chunks."""
         if not relevant_chunks:
             logging.warning("No relevant chunks found for the query.")
             # Decide how to respond: could be a fixed message or still ask the LLM
@@ -281,16 +1371,28 @@ class RAGProcessor:
 
         Answer:
         """
+        return prompt
+
+    def _completion_messages(self, prompt):
+        """Builds the chat messages list for a completion request."""
+        return [
+            {"role": "system", "content": "You are a helpful assistant answering questions based on provided context."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _generate_answer(self, query, relevant_chunks):
+        """
+        Builds the RAG prompt from the retrieved chunks and calls the OpenAI
+        API to generate an answer for a single query.
+        """
+        prompt = self._build_prompt(query, relevant_chunks)
 
         logging.info("Sending request to OpenAI API...")
         # 3. Call OpenAI API
         try:
             response = self.openai_client.chat.completions.create(
                 model="gpt-3.5-turbo", # Or use "gpt-4" if preferred/available
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant answering questions based on provided context."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._completion_messages(prompt),
                 temperature=0.2, # Lower temperature for more factual answers
                 max_tokens=250 # Adjust as needed
             )
@@ -300,5 +1402,37 @@ class RAGProcessor:
 
         except Exception as e:
             logging.error(f"Error calling OpenAI API: {e}", exc_info=True)
-            return "Sorry, I encountered an error while trying to generate an answer."
+            return ERROR_ANSWER
+
+    def answer_query_stream(self, query, k=5):
+        """
+        Streaming variant of answer_query: yields answer text deltas as the
+        LLM produces them, so a caller can forward the first token after
+        first-token latency instead of waiting for the full completion.
+
+        Retrieval and prompt construction run up front; only the OpenAI
+        call streams. Kept synchronous - the Flask/gunicorn stack here is
+        WSGI, and a plain generator plugs straight into a chunked Response.
+        """
+        logging.info(f"Answering query (streaming): '{query}'")
+        relevant_chunks = self.retrieve_relevant_chunks(query, k=k)
+        prompt = self._build_prompt(query, relevant_chunks)
+
+        logging.info("Sending streaming request to OpenAI API...")
+        try:
+            stream = self.openai_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._completion_messages(prompt),
+                temperature=0.2,
+                max_tokens=250,
+                stream=True
+            )
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+            logging.info("Streaming response from OpenAI API complete.")
+        except Exception as e:
+            logging.error(f"Error calling OpenAI API: {e}", exc_info=True)
+            yield ERROR_ANSWER
 
@@ -0,0 +1,27 @@
+"""
+WSGI entry point for running the backend under gunicorn.
+
+The Flask dev server (python app.py) is single-threaded, so concurrent
+/upload and /query requests serialize behind each other — including the
+slow OpenAI round-trip. For real use, run with multiple workers/threads:
+
+    gunicorn -w 4 -k gthread --threads 4 --preload wsgi:app
+
+--preload shares the imported code and Python heap copy-on-write across
+workers. The FAISS index and embedding model are NOT shared: they load
+lazily on first use (so they can't be initialized in the master and
+forked mid-load), which means each worker pays the load cost and holds
+its own copy. The post_fork hook in gunicorn.conf.py starts that load
+in the background right after the fork so the first query doesn't wait
+for it. Workers ~2x CPU count works well since most request time is
+spent waiting on the OpenAI API.
+
+Uploads land in the handling worker's memory and on disk; the other
+workers detect the on-disk change before their next query batch and
+reload (RAGProcessor.refresh_if_stale), so answers converge on the new
+corpus without a restart.
+"""
+from app import app
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=5000)